@@ -0,0 +1,86 @@
+#!/bin/env python2.7
+"""Compare the throughput of reading module attributes when they are replaced
+   by a ModuleType subclass overriding __getattribute__, as in the tests, and
+   by MetaServices.override_attributes(), and the cost of tracing them with
+   MetaServices.trace_attributes().
+
+   Usage: python2.7 benchmarks/bench_attributes.py [NUMBER]
+"""
+
+import os
+import sys
+import shutil
+import timeit
+import logging
+import tempfile
+import __builtin__
+
+from types import ModuleType
+
+from tau.metaservices import MetaServices
+
+SOURCE = """
+class Request(object):
+    pass
+"""
+
+MODULES = ('bench_plain', 'bench_intercepted', 'bench_overridden', 'bench_fallback',
+           'bench_traced', 'bench_traced_all')
+
+READS = (
+    ("plain module", 'bench_plain', 'Request'),
+    ("__getattribute__ subclass", 'bench_intercepted', 'Request'),
+    ("override_attributes()", 'bench_overridden', 'Request'),
+    ("fallback, name present", 'bench_fallback', 'Request'),
+    ("fallback, name missing", 'bench_fallback', 'Missing'),
+    ("traced, 1 in 100", 'bench_traced', 'Request'),
+    ("traced, every read", 'bench_traced_all', 'Request'),
+)
+
+
+class Replacement(object):
+    pass
+
+
+class InterceptingModule(ModuleType):
+    """Replaces the attribute Request on every read, logging each one."""
+
+    def __getattribute__(self, name):
+        logging.debug("fetching attr %r of module %r", name, ModuleType.__getattribute__(self, '__name__'))
+        if name == 'Request':
+            return Replacement
+        return ModuleType.__getattribute__(self, name)
+
+
+def main(number=1000000):
+    native_import = __builtin__.__import__
+
+    tmpdir = tempfile.mkdtemp()
+    for modname in MODULES:
+        with open(os.path.join(tmpdir, modname + '.py'), 'w') as f:
+            f.write(SOURCE)
+    sys.path.insert(0, tmpdir)
+
+    ms = MetaServices()
+    ms.subclass_module('bench_intercepted', InterceptingModule)
+    ms.override_attributes('bench_overridden', {'Request': Replacement})
+    ms.override_attributes('bench_fallback', fallback=lambda name: Replacement)
+    ms.trace_attributes('bench_traced', sample=100)
+    ms.trace_attributes('bench_traced_all', sample=1)
+    try:
+        for modname in MODULES:
+            __import__(modname)
+    finally:
+        __builtin__.__import__ = native_import
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+    print "%-28s %14s" % ("module", "read")
+    for title, modname, attr in READS:
+        setup = "import sys; m = sys.modules[%r]" % (modname, )
+        seconds = min(timeit.repeat("m.%s" % (attr, ), setup, number=number, repeat=3)) / number
+        print "%-28s %12.1fns" % (title, seconds * 1e9)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,78 @@
+#!/bin/env python2.7
+"""Compare the startup cost of importing a large set of modules in a fresh
+   interpreter, natively and under each MetaServices backend.
+
+   The module set is the standard library, top-level modules and packages plus
+   their direct submodules, a few hundred modules in all.
+
+   Usage: python2.7 benchmarks/bench_backends.py [REPEAT]
+"""
+
+import os
+import sys
+import pkgutil
+import subprocess
+
+SKIPPED = set((
+    'antigravity', 'this', 'idlelib', 'lib2to3', 'test', 'tkinter', 'Tkinter',
+    'turtle', 'turtledemo', 'pydoc_data', 'bsddb', 'ensurepip', 'site',
+))
+
+SETUPS = {
+    'native':   "",
+    'ihooks':   "from tau.metaservices import MetaServices\n"
+                "MetaServices('ihooks').call_after_import_of('a_module_never_imported', None)\n",
+    'metapath': "from tau.metaservices import MetaServices\n"
+                "MetaServices('metapath').call_after_import_of('a_module_never_imported', None)\n",
+}
+
+CHILD = """
+import sys, time
+%s
+start = time.time()
+for modname in sys.stdin.read().split():
+    try:
+        __import__(modname)
+    except (Exception, SystemExit):
+        pass
+print time.time() - start, len(sys.modules)
+"""
+
+
+def stdlib_modnames():
+    stdlib_dir = os.path.dirname(os.__file__)
+
+    modnames = []
+    for _, modname, ispkg in pkgutil.iter_modules([stdlib_dir]):
+        if modname in SKIPPED:
+            continue
+        modnames.append(modname)
+        if ispkg:
+            pkgdir = os.path.join(stdlib_dir, modname)
+            for _, submodname, _ in pkgutil.iter_modules([pkgdir]):
+                if submodname not in ('test', '__main__') and not submodname.startswith('test_'):
+                    modnames.append(modname + '.' + submodname)
+    return modnames
+
+
+def run_child(setup, modnames):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    child = subprocess.Popen([sys.executable, '-c', CHILD % setup], env=env,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+    out, _ = child.communicate('\n'.join(modnames))
+    elapsed, nmodules = out.split()[-2:]
+    return float(elapsed), int(nmodules)
+
+
+def main(repeat=5):
+    modnames = stdlib_modnames()
+    print "Importing %d modules, best of %d runs" % (len(modnames), repeat)
+
+    for backend in ('native', 'ihooks', 'metapath'):
+        runs = [run_child(SETUPS[backend], modnames) for _ in range(repeat)]
+        elapsed, nmodules = min(runs)
+        print "%-10s %8.1fms  (%d modules loaded)" % (backend, elapsed * 1e3, nmodules)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,51 @@
+#!/bin/env python2.7
+"""Compare the latency of imports of already-loaded modules with and without
+   the MetaServices import hook installed.
+
+   Usage: python2.7 benchmarks/bench_fastpath.py [NUMBER]
+"""
+
+import sys
+import timeit
+import __builtin__
+
+from tau.metaservices import MetaServices
+
+STATEMENTS = (
+    ("import os", "import os"),
+    ("import os.path", "import os.path"),
+    ("from os import path", "from os import path"),
+    ("from os.path import join", "from os.path import join"),
+)
+
+
+def measure(number):
+    results = {}
+    for title, stmt in STATEMENTS:
+        results[title] = min(timeit.repeat(stmt, number=number, repeat=3)) / number
+    return results
+
+
+def main(number=100000):
+    native_import = __builtin__.__import__
+
+    unhooked = measure(number)
+
+    ms = MetaServices()
+    ms.call_after_import_of('a_module_never_imported', lambda mod: None)  # installs the hook
+    try:
+        hooked = measure(number)
+
+        ms.call_after_import_of('os', lambda mod: None)  # force the full import machinery
+        watched = measure(number / 10)
+    finally:
+        __builtin__.__import__ = native_import
+
+    print "%-28s %12s %12s %12s" % ("statement", "native", "hooked", "watched")
+    for title, stmt in STATEMENTS:
+        print "%-28s %10.3fus %10.3fus %10.3fus" % (
+            title, unhooked[title] * 1e6, hooked[title] * 1e6, watched[title] * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,71 @@
+#!/bin/env python2.7
+"""Compare the cold-cache startup cost of importing a large set of modules with
+   and without MetaServices.prefetch_manifest() reading their files ahead.
+
+   The module set is that of bench_backends.py.  A manifest is recorded by a
+   first, warm run; before each timed run the page cache is dropped, which
+   takes root, so without it the runs are warm and say little.
+
+   Usage: python2.7 benchmarks/bench_prefetch.py [REPEAT]
+"""
+
+import os
+import sys
+import tempfile
+import subprocess
+
+from bench_backends import stdlib_modnames, run_child
+
+RECORD = ("from tau.metaservices import MetaServices\n"
+          "import atexit\n"
+          "ms = MetaServices('ihooks')\n"
+          "ms.record_manifest()\n"
+          "atexit.register(ms.stop_manifest, %r)\n")
+
+SETUPS = (
+    ('native', ""),
+    ('native+prefetch', "from tau.metaservices import MetaServices\n"
+                        "MetaServices('metapath').prefetch_manifest(%(manifest)r)\n"),
+    ('ihooks', "from tau.metaservices import MetaServices\n"
+               "MetaServices('ihooks').install()\n"),
+    ('ihooks+prefetch', "from tau.metaservices import MetaServices\n"
+                        "MetaServices('ihooks').prefetch_manifest(%(manifest)r)\n"),
+)
+
+
+def drop_caches():
+    """Drop the page cache, returning whether that was allowed."""
+
+    subprocess.call(['sync'])
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+    except IOError:
+        return False
+    return True
+
+
+def main(repeat=3):
+    modnames = stdlib_modnames()
+
+    fd, manifest = tempfile.mkstemp(suffix='.manifest')
+    os.close(fd)
+    try:
+        run_child(RECORD % (manifest, ), modnames)
+
+        cold = drop_caches()
+        print "Importing %d modules, best of %d %s runs" % (len(modnames), repeat, "cold" if cold else "WARM")
+
+        for title, setup in SETUPS:
+            runs = []
+            for _ in range(repeat):
+                drop_caches()
+                runs.append(run_child(setup % {'manifest': manifest}, modnames))
+            elapsed, nmodules = min(runs)
+            print "%-16s %8.1fms  (%d modules loaded)" % (title, elapsed * 1e3, nmodules)
+    finally:
+        os.remove(manifest)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
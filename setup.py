@@ -75,7 +75,8 @@ setup(
     ],
 
     extras_require={
-        'test': ['zope.testrunner',]
+        'test': ['zope.testrunner',],
+        'scandir': ['scandir',],  # faster directory walks by walktrees()
     },
 
     entry_points="""
@@ -1,4 +1,6 @@
 from metaservices import MetaServices
+from lazy import LazyImportError
+from blocklist import BlockedImportError
 
 from tplmapper import tplmapper
 from imports import imports
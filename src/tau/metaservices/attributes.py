@@ -0,0 +1,42 @@
+"""Modules that supply their missing attributes, as modules may do in Python 3.7.
+"""
+
+from types import ModuleType
+
+
+class FallbackModule(ModuleType):
+    """Module whose missing attributes are looked up by a __getattr__(name) function in it.
+
+       Like a module-level __getattr__ of PEP 562, the function is called only
+       for names the module does not have, so reading the names it does have
+       costs the same as for any module.
+    """
+
+    def __getattr__(self, name):
+        getattr_ = self.__dict__.get('__getattr__')
+        if getattr_ is None or name == '__path__':  # probed by the import machinery, and set if a package
+            raise AttributeError("'module' object has no attribute %r" % (name, ))
+        return getattr_(name)
+
+
+def with_fallback(mod_cls):
+    """Return a subclass of ModuleType subclass mod_cls whose instances are also FallbackModules."""
+
+    if issubclass(mod_cls, FallbackModule):
+        return mod_cls
+
+    cls = _fallback_classes.get(mod_cls)
+    if cls is None:
+        cls = _fallback_classes[mod_cls] = type('Fallback' + mod_cls.__name__, (FallbackModule, mod_cls), {})
+    return cls
+
+_fallback_classes = {ModuleType: FallbackModule}
+
+
+def apply_overrides(m, overrides, fallback):
+    """Set the attributes of module m given in overrides, and its fallback for missing ones."""
+
+    for name, value in overrides.items():
+        setattr(m, name, value)
+    if fallback is not None:
+        m.__getattr__ = fallback
@@ -0,0 +1,59 @@
+"""Modules kept from loading, failing their imports or standing in a stub for them.
+"""
+
+import sys
+import logging
+
+from types import ModuleType
+
+log = logging.getLogger('tau.metaservices')
+
+
+class BlockedImportError(ImportError):
+    """The import of a module was refused, as it is on the blocklist."""
+
+
+def import_chain(frame):
+    """Return the names of the modules whose code is running in frame and those it was called from, outermost first."""
+
+    chain = []
+    while frame is not None:
+        if frame.f_code.co_name == '<module>':
+            chain.append(frame.f_globals.get('__name__', '?'))
+        frame = frame.f_back
+    chain.reverse()
+    return chain
+
+
+def make_stub(name, stub):
+    """Return the module standing in for module name, given the stub registered for it.
+
+       The stub is a module, used as it is, a ModuleType subclass, of which
+       an instance is made as by MetaServices.subclass_module(), or a dict,
+       of the attributes of a plain module.
+    """
+    if isinstance(stub, ModuleType):
+        return stub
+
+    if isinstance(stub, type) and issubclass(stub, ModuleType):
+        return stub(name)
+
+    m = ModuleType(name)
+    m.__dict__.update(stub)
+    return m
+
+
+def blocked(services, name, stub, frame):
+    """Put the stub of blocked module name in sys.modules and return it, or if None raise BlockedImportError."""
+
+    chain = import_chain(frame)
+    services.blocked_imports.append((name, chain))
+
+    requested_by = ' -> '.join(chain) or '?'
+    if stub is None:
+        log.warning("Refused import of blocked module %r, requested by %s", name, requested_by)
+        raise BlockedImportError("Import of module %r is blocked, requested by %s" % (name, requested_by))
+
+    log.warning("Stubbed import of blocked module %r, requested by %s", name, requested_by)
+    m = sys.modules[name] = make_stub(name, stub)
+    return m
@@ -0,0 +1,44 @@
+"""Cached directory listings, for answering whether files exist without a system call each.
+"""
+
+import os
+
+
+class DirectoryCache(object):
+    """Listings of directories, each refreshed when the mtime of its directory changes.
+
+       The module search of the 'ihooks' backend tries to open a file for
+       each suffix, in each directory on the path, for each module; with a
+       listing, the search of a directory costs one stat of it, to check its
+       mtime, and the files not there, by far the most, are not tried.
+    """
+
+    def __init__(self):
+        self.listings = {}  # directory -> (mtime, frozenset of names in it)
+        self.hits = 0       # lookups answered by a listing
+        self.misses = 0     # lookups that had to list a directory, again or for the first time
+
+    def listing(self, dirname):
+        """Return the set of names in directory dirname, or None if it is there but cannot be listed."""
+
+        try:
+            mtime = os.stat(dirname or os.curdir).st_mtime
+        except OSError:  # not there, so neither is anything in it
+            self.listings.pop(dirname, None)
+            return frozenset()
+
+        cached = self.listings.get(dirname)
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        try:
+            names = frozenset(os.listdir(dirname or os.curdir))
+        except OSError:
+            return None
+        self.listings[dirname] = (mtime, names)
+        return names
+
+    def clear(self):
+        self.listings.clear()
@@ -0,0 +1,151 @@
+"""An index of the files of installed distributions, read from their metadata.
+"""
+
+import os
+import csv
+import sys
+import logging
+
+log = logging.getLogger('tau.metaservices')
+
+AMBIGUOUS = ('', '')  # stands for a path claimed by more than one distribution, e.g. a namespace package
+
+
+class DistributionIndex(object):
+    """Map from the paths of installed files and their directories to the distribution owning them.
+
+       Built once from the metadata of every distribution found on the
+       entries of a path, by default sys.path:
+
+       - NAME.dist-info/RECORD, of wheels
+       - NAME.egg-info/installed-files.txt, of eggs installed flat
+       - NAME.egg-info/SOURCES.txt or top_level.txt, of development eggs
+       - NAME.egg/EGG-INFO/SOURCES.txt or top_level.txt, of unzipped eggs
+
+       A lookup climbs from a path to the first one indexed, so takes as many
+       dict lookups as the path is deep.  Paths outside of any distribution,
+       such as the standard library, and directories shared by several, as
+       namespace packages are, are not answered.
+    """
+
+    def __init__(self, path=None):
+        self.owners = {}         # absolute path -> (distribution directory, name), or AMBIGUOUS
+        self.distributions = []  # (distribution directory, name) of each distribution indexed
+        for entry in (sys.path if path is None else path):
+            self.add_entry(entry)
+
+    def lookup(self, pathname):
+        """Return the (distribution directory, name) owning the file or directory at pathname, or None."""
+
+        owners = self.owners
+        pathname = os.path.abspath(pathname)
+        while True:
+            owner = owners.get(pathname)
+            if owner is not None:
+                return owner if owner is not AMBIGUOUS else None
+
+            parent = os.path.dirname(pathname)
+            if parent == pathname:
+                return None
+            pathname = parent
+
+    def add_entry(self, entry):
+        """Index the distributions installed in the sys.path entry, or that it is."""
+
+        entry = os.path.abspath(entry or os.curdir)
+        if not os.path.isdir(entry):
+            return  # e.g. a zipped egg, of which the path names alone tell
+
+        if entry.endswith('.egg'):
+            self._add_egg(entry)
+            return
+
+        try:
+            names = os.listdir(entry)
+        except OSError:
+            return
+        for name in names:
+            metadir = os.path.join(entry, name)
+            if name.endswith('.dist-info'):
+                self._add_files(entry, _distname(name), entry, _read_record(metadir))
+            elif name.endswith('.egg-info') and os.path.isdir(metadir):
+                files = _read_lines(os.path.join(metadir, 'installed-files.txt'))
+                if files:
+                    self._add_files(entry, _distname(name), metadir, files)
+                else:
+                    self._add_sources(entry, _distname(name), entry, metadir)
+
+    def _add_egg(self, egg):
+        dirpath, eggname = os.path.split(egg)
+        self._add_sources(dirpath, _distname(eggname), egg, os.path.join(egg, 'EGG-INFO'))
+
+    def _add_files(self, distdir, distname, base, files):
+        """Index files, relative to base, and their directories within distdir, as of distribution distname."""
+
+        owner = (distdir, distname)
+        self.distributions.append(owner)
+        for filename in files:
+            pathname = os.path.normpath(os.path.join(base, filename))
+            while pathname.startswith(distdir + os.sep):  # the file, then its directories up to distdir
+                if not self._claim(pathname, owner):
+                    break
+                pathname = os.path.dirname(pathname)
+
+    def _add_sources(self, distdir, distname, location, metadir):
+        """Index the packages of a distribution installed at location, from SOURCES.txt or top_level.txt.
+
+           SOURCES.txt lists files as found in the source tree, e.g. under
+           src/, so a file is placed at location from its top-level package.
+        """
+        toplevels = set(_read_lines(os.path.join(metadir, 'top_level.txt')))
+        if not toplevels:
+            return
+
+        files = []
+        for filename in _read_lines(os.path.join(metadir, 'SOURCES.txt')):
+            parts = filename.replace('\\', '/').split('/')
+            for i, part in enumerate(parts):
+                if part in toplevels or (i == len(parts) - 1 and os.path.splitext(part)[0] in toplevels):
+                    files.append(os.path.join(*parts[i:]))
+                    break
+
+        if not files:  # no sources listed, so take each top-level package as a whole
+            files = [os.path.join(toplevel, '__init__.py') for toplevel in toplevels] + \
+                    [toplevel + '.py' for toplevel in toplevels]
+        self._add_files(distdir, distname, location, files)
+
+    def _claim(self, pathname, owner):
+        """Note owner as owning pathname, returning False if it did already, and so its directories too."""
+
+        current = self.owners.get(pathname)
+        if current is None:
+            self.owners[pathname] = owner
+            return True
+        if current == owner:
+            return False
+        if current is not AMBIGUOUS:
+            log.debug("Path %r is in both distributions %r and %r", pathname, current[1], owner[1])
+            self.owners[pathname] = AMBIGUOUS
+        return True
+
+
+def _distname(name):
+    """Return the distribution name from the name of a .dist-info, .egg-info or .egg."""
+
+    return os.path.splitext(name)[0].split('-', 1)[0]
+
+
+def _read_lines(filename):
+    try:
+        with open(filename) as f:
+            return [line.strip() for line in f if line.strip()]
+    except IOError:
+        return []
+
+
+def _read_record(metadir):
+    try:
+        with open(os.path.join(metadir, 'RECORD'), 'rb') as f:
+            return [row[0] for row in csv.reader(f) if row]
+    except IOError:
+        return []
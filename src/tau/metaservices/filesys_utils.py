@@ -6,14 +6,73 @@
 
 import logging
 import os
+import re
+import sys
 import types
+import Queue
+import threading
 
-from fnmatch import fnmatch
+from stat import S_ISDIR
+from fnmatch import translate
+
+from prunerules import PruneRules
+
+try:
+    from scandir import scandir  # the backport of os.scandir(), if installed
+except ImportError:
+    scandir = None
 
 log = logging.getLogger('tau.metaservices')
 
+SKIPPED_DIRNAMES = frozenset(['.svn', '.git'])
+
+
+def filename_matcher(filepatts):
+    """Return a function telling whether a filename matches any of filepatts, as one compiled regex."""
+
+    if not filepatts:
+        return lambda filename: None  # no pattern, so no match, not the empty regex matching all
+    return re.compile('|'.join('(?:%s)' % translate(filepatt) for filepatt in filepatts)).match
+
 
-def walktrees(rootdirs, filepatts=None, recurse=False):
+def list_directory(dirpath, identities=None):
+    """Return the names of the files and of the subdirectories in dirpath, following symbolic links.
+
+       With scandir, the type of most entries comes with the listing itself,
+       and only symbolic links need a stat; without, each entry takes one, as
+       with os.walk(), and the (st_dev, st_ino) of each file is put in the
+       dict identities, if given.  A directory that cannot be listed is taken
+       as empty.
+    """
+    filenames, dirnames = [], []
+    try:
+        if scandir is not None:
+            for entry in scandir(dirpath):
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                (dirnames if is_dir else filenames).append(entry.name)
+        else:
+            stat, join = os.stat, os.path.join
+            for name in os.listdir(dirpath):
+                try:
+                    st = stat(join(dirpath, name))
+                except OSError:  # e.g. a broken symbolic link, taken as a file as by os.walk()
+                    filenames.append(name)
+                    continue
+                if S_ISDIR(st.st_mode):
+                    dirnames.append(name)
+                else:
+                    filenames.append(name)
+                    if identities is not None:
+                        identities[name] = st.st_dev, st.st_ino
+    except OSError, exc:
+        log.debug("Cannot list directory %r: %s", dirpath, exc)
+    return filenames, dirnames
+
+
+def walktrees(rootdirs, filepatts=None, recurse=False, threads=1, aliases=None, prune=None):
     """Walk one (or more) directory trees, yielding paths to matching filenames.
 
        This function extends to os.walk() function in the standard library by:
@@ -22,7 +81,26 @@ def walktrees(rootdirs, filepatts=None, recurse=False):
        2) skipping over Subversion and Git hidden directories
        3) following symbolic links, since they are used in buildouts for developer eggs
        4) only returns files, not directories
-       5) matches against filename patterns
+       5) matches against filename patterns, each file yielded once however many it matches
+       6) listing directories in a pool of threads, if threads > 1, so trees and subtrees are walked at once
+       7) walking each directory, and yielding each file, once however many paths reach it
+       8) leaving out the directories and files matched by prune rules, as of a .gitignore
+
+       Directories and files are told apart by their (st_dev, st_ino), so
+       symbolic link loops end, and a file reached both through an omelette
+       and in its egg is yielded once, by the first path to it.  If
+       aliases is a dict, each such first path of a directory or file is
+       mapped in it to a list of the other paths found to it; the files of
+       a directory reached again are not looked at, nor listed there.
+
+       The prune rules are a PruneRules, or lines of an ignore file, matched
+       against paths relative to each root.  A directory they match is
+       never listed.
+
+       Paths are yielded in the order of os.walk(), tree by tree, and the
+       first path to a file is the first in that order, however many threads
+       list the directories.  Threads pay off on trees on network or cold
+       disks, seldom on a warm page cache.
     """
 
     if rootdirs is None:            # if not given a set of root directories to traverse,
@@ -38,117 +116,436 @@ def walktrees(rootdirs, filepatts=None, recurse=False):
         if not os.path.isdir(rootdir):
             raise IOError("ERROR: Root directory %r is NOT actually a directory!" % rootdir)
 
-        for dirpath, dirnames, filenames in os.walk(rootdir, followlinks=True):
+    if prune is not None and not isinstance(prune, PruneRules):
+        prune = PruneRules(prune)
+
+    match = filename_matcher(filepatts) if filepatts is not None else None
+    visit = _Visitor(match, aliases, prune or None)
+    roots = [(rootdir, '') for rootdir in rootdirs]
 
-            if '.svn' in dirnames:  # do not descend into .svn directories
-                dirnames.remove('.svn')
-            if '.git' in dirnames:  # do not descend into .git directories
-                dirnames.remove('.git')
+    if recurse and threads > 1:
+        walk = _walk_threaded(roots, visit, threads)
+    else:
+        walk = _walk(roots, visit, recurse)
+
+    for filenames in walk:
+        for filename in filenames:
+            yield filename
+
+
+def file_identity(path):
+    """Return the (st_dev, st_ino) of path, following symbolic links, or None if it cannot be had."""
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class _Visitor(object):
+    """Lister of the directories of a walk, each once, keeping the paths to files already found out."""
+
+    def __init__(self, match, aliases, prune):
+        self.match = match
+        self.aliases = aliases
+        self.prune = prune
+        self.seen = {}  # (st_dev, st_ino) -> (first path found to the directory or file, )
+
+    def __call__(self, (dirpath, relpath), key=None, listing=None):
+        """Return the new matching files of dirpath and its subdirectories, or None if it was visited before.
+
+           The subdirectories are (path, path relative to the root) pairs,
+           like the one given.  The (st_dev, st_ino) of dirpath and its
+           listing, as of listing(), are looked up if not given.
+        """
+
+        if not self._first(dirpath, key):
+            return None
+
+        if listing is None:
+            identities = {}
+            filenames, dirnames = list_directory(dirpath, identities)
+        else:
+            filenames, dirnames, identities = listing
+
+        join, match, first, prune = os.path.join, self.match, self._first, self.prune
+        prefix = relpath + '/' if relpath else ''
+        found = []
+        for filename in filenames:
+            if match is None or match(filename):
+                if prune is not None and prune.prunes_file(prefix + filename):
+                    continue
+                path = join(dirpath, filename)
+                if first(path, identities.get(filename)):
+                    found.append(path)
+
+        return found, self.subdirs(dirpath, relpath, dirnames)
+
+    def subdirs(self, dirpath, relpath, dirnames):
+        """Return the (path, relative path) of the subdirectories dirnames of dirpath to walk."""
+
+        join, prefix = os.path.join, relpath + '/' if relpath else ''
+        subdirs = [(join(dirpath, dirname), prefix + dirname) for dirname in dirnames
+                   if dirname not in SKIPPED_DIRNAMES]
+        if self.prune is not None:
+            subdirs = [subdir for subdir in subdirs if not self.prune.prunes_dir(subdir[1])]
+        return subdirs
+
+    def listing(self, dirpath):
+        """Return the filenames and subdirectory names of dirpath, and the (st_dev, st_ino) of its matching files."""
+
+        identities = {}
+        filenames, dirnames = list_directory(dirpath, identities)
+        join, match = os.path.join, self.match
+        for filename in filenames:
+            if filename not in identities and (match is None or match(filename)):
+                key = file_identity(join(dirpath, filename))
+                if key is not None:
+                    identities[filename] = key
+        return filenames, dirnames, identities
+
+    def _first(self, path, key=None):
+        """Return whether path is the first found to its directory or file, noting it as an alias if not."""
+
+        if key is None:
+            key = file_identity(path)
+        if key is None:
+            return True  # cannot tell, so taken as unlike any other
+
+        claim = (path, )
+        first = self.seen.setdefault(key, claim)
+        if first is claim:
+            return True
+
+        if self.aliases is not None and first[0] != path:  # not the same tree given twice
+            self.aliases.setdefault(first[0], []).append(path)
+        return False
+
+
+def _walk(roots, visit, recurse, lookup=None):
+    """Yield the lists of new files of the directories of roots, top-down, in this thread.
+
+       If given, lookup(path) returns the (st_dev, st_ino) and listing of
+       the directory at path, or Nones, for visit() to take rather than
+       look them up itself.
+    """
+
+    for root in roots:
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            if lookup is None:
+                listing = visit(directory)
+            else:
+                listing = visit(directory, *lookup(directory[0]))
+            if listing is None:
+                continue
+
+            found, subdirs = listing
+            yield found
+            if recurse:
+                subdirs.reverse()
+                pending.extend(subdirs)
+
+
+def _walk_threaded(roots, visit, threads):
+    """Yield the lists of new files of the directories of roots, as _walk() does, with directories listed ahead.
+
+       A pool of threads lists each directory reached once, by whichever
+       path gets to it first, while this thread walks the trees in the
+       order of _walk() from their listings, waiting for those not yet
+       made.  So which path to a file is yielded, and which are noted as
+       its aliases, does not depend on how the threads are scheduled.  A
+       directory the threads did not list, as being reached here by a path
+       they pruned or did not take, is listed here.  An exception raised in
+       a thread is raised here, ending the walk.
+    """
 
-            for filename in filenames:
+    if not roots:
+        return
+
+    keys = {}                 # path -> (st_dev, st_ino) of each directory the threads reached, or None
+    listings = {}             # (st_dev, st_ino) -> listing of each directory, as of visit.listing()
+    claims = {}               # (st_dev, st_ino) -> (path of the thread listing the directory, )
+    dirpaths = Queue.Queue()  # (path, relative path) of directories to list, or None for a thread to finish
+    pending = [len(roots)]    # directories queued or being listed
+    done = []                 # non-empty once all directories are listed
+    failed = []               # sys.exc_info() of each exception raised in a thread
+    ready = threading.Condition()
+    stopped = []              # non-empty once the consumer went away, to drain the queue unlisted
+
+    def lister():
+        while True:
+            directory = dirpaths.get()
+            if directory is None:
+                return
+
+            subdirs = ()
+            try:
+                if not stopped:
+                    dirpath, relpath = directory
+                    key = file_identity(dirpath)
+                    listing = None
+                    if key is not None:
+                        claim = (dirpath, )
+                        if claims.setdefault(key, claim) is claim:  # setdefault() is atomic, so one thread lists it
+                            listing = visit.listing(dirpath)
+                            subdirs = visit.subdirs(dirpath, relpath, listing[1])
+                    with ready:
+                        keys[dirpath] = key
+                        if listing is not None:
+                            listings[key] = listing
+                        ready.notify_all()
+            except Exception:
+                subdirs = ()
+                with ready:
+                    failed.append(sys.exc_info())  # for the consumer to raise
+                    ready.notify_all()
+            finally:
+                with ready:
+                    pending[0] += len(subdirs) - 1
+                    finished = not pending[0]
+                    if finished:
+                        done.append(True)
+                        ready.notify_all()
+                for subdir in subdirs:
+                    dirpaths.put(subdir)
+
+                if finished:
+                    for _ in range(threads):
+                        dirpaths.put(None)
+
+    def lookup(dirpath):
+        with ready:
+            while not done and not failed and \
+                    (dirpath not in keys or (keys[dirpath] is not None and keys[dirpath] not in listings)):
+                ready.wait()
+            if failed:
+                exc_type, exc, tb = failed[0]
+                raise exc_type, exc, tb
+            key = keys.get(dirpath)
+            return key, listings.get(key)
+
+    for root in roots:
+        dirpaths.put(root)
+    for _ in range(threads):
+        thread = threading.Thread(target=lister, name='walktrees')
+        thread.daemon = True
+        thread.start()
+
+    try:
+        for found in _walk(roots, visit, True, lookup):
+            yield found
+    finally:
+        stopped.append(True)
+
+
+class DirectoryResolver(object):
+    """Package names and distributions of directories, each worked out once and remembered.
+
+       Files in the same directory share all their ancestors, so rather than
+       climbing from each file to the top, a lookup climbs only as far as the
+       first directory already known, and remembers the answer for every
+       directory passed on the way.  The directories are expected not to
+       change while the resolver is in use, or clear() to be called when
+       they do.  Share a resolver by passing it along.
+
+       A lookup answered from the directory of the file, or the file itself,
+       being known counts as a hit, any other as a miss.
+    """
 
-                if filepatts is None:
-                    full_filename = os.path.join(dirpath, filename)
-                    yield full_filename
+    def __init__(self):
+        self.packages = {}  # directory -> dotted name of the package it is, '' if none, None if packages reach '/'
+        self.distros = {}   # directory -> (distribution directory, name), or None if none was found up to '/'
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """Forget every directory worked out, as after the trees changed, keeping the counts of lookups."""
+
+        self.packages.clear()
+        self.distros.clear()
+
+    def pkgname(self, src_filename):
+        """Given path to a srcfile or dir, ascend directories and return its dotted package name.
+
+           Note that a package name is NOT the same as a distribution name, or the
+           egg from which it came.  A distribution may contain multiple packages,
+           or the srcfile may be in the standard library, which isn't a
+           distribution/egg.
+        """
+
+        if os.path.isfile(src_filename):
+            # discard trailing .py filename, keeping only dirname
+            pathname, src_filename = os.path.split(src_filename)
+        else:
+            pathname = src_filename
+
+        pathname = os.path.abspath(pathname)
+
+        packages = self.packages
+        if pathname in packages:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+            chain = []  # directories passed, each the package of those before it, whatever the ones above are
+            while pathname not in packages:
+                if pathname == '/':
+                    packages[pathname] = None
+                    break
+
+                log.debug("Seeking PackageName for pathname=%r", pathname)
+
+                if os.path.isdir(pathname):
+                    if not os.path.isfile(os.path.join(pathname, '__init__.py')):
+                        packages[pathname] = ''  # not a package, so nor is any above it part of the name
+                        break
+                    chain.append((pathname, True))
                 else:
-                    for filepatt in filepatts:
-                        if fnmatch(filename, filepatt):
-                            full_filename = os.path.join(dirpath, filename)
-                            yield full_filename
+                    chain.append((pathname, False))  # no such directory, so named as its parent
 
-            if not recurse:
-                break
+                pathname, _ = os.path.split(pathname)  # ascend by stripping off a level of child-directory
 
+            name = packages[pathname]
+            for pathname, is_package in reversed(chain):
+                if is_package and name is not None:
+                    segment = os.path.basename(pathname)
+                    name = name + '.' + segment if name else segment
+                packages[pathname] = name
 
-def pkgname_from_src_filename(src_filename):
-    """Given path to a srcfile or dir, ascend directories and return its dotted package name.
+        name = packages[pathname]
+        if name is None:
+            return [os.path.splitext(src_filename)[0]]  # not part of a package, just return the module name
+        return name
 
-       Note that a package name is NOT the same as a distribution name, or the
-       egg from which it came.  A distribution may contain multiple packages,
-       or the srcfile may be in the standard library, which isn't a
-       distribution/egg.
-    """
+    def distro(self, src_filename):
+        """Give path to a srcfile, egg or directory, return its distribution directory and name.
+        """
+        pathname = os.path.abspath(src_filename)  # convert partial names to full names
 
-    if os.path.isfile(src_filename):
-        # discard trailing .py filename, keeping only dirname
-        pathname, src_filename = os.path.split(src_filename)
-    else:
-        pathname = src_filename
+        found = self.distros.get(pathname, False)
+        if found is False:
+            found = self._distro_of_file(pathname)
+        else:
+            self.hits += 1
 
-    pathname = os.path.abspath(pathname)
+        if found is None:
+            return os.path.split(src_filename)[0], 'extralib'  # not an egg of any kind, nor in the standard library
+        return found
 
-    module_segments = []  # accumulate intermediate module names as we ascend from a srcfile
-    while pathname != '/':
-        log.debug("Seeking PackageName for pathname=%r", pathname)
+    def _distro_of_file(self, pathname):
+        """Check the file at pathname itself, as the directories are, then look up its directory."""
 
         if os.path.isdir(pathname):
-            testname = os.path.join(pathname, '__init__.py')
-            if os.path.isfile(testname):  # found a directory with an __init__.py file
-                _, segment = os.path.split(pathname)
-                module_segments.append(segment)
-            else:
-                return '.'.join(reversed(module_segments))
+            return self._distro_of_dir(pathname)
+
+        if os.path.islink(pathname):
+            pathname = _follow_link(pathname)
 
-        pathname, _ = os.path.split(pathname)  # ascend by stripping off a level of child-directory
+        if pathname.endswith('.egg'):  # a zipped egg
+            dirpath, eggname = os.path.split(pathname)
+            log.debug("Found Distribution: %s", eggname.split('-', 1)[0])
+            return dirpath, eggname.split('-', 1)[0]
 
-    return [os.path.splitext(src_filename)[0]]  # not part of a package, just return the module name
+        dirpath = os.path.dirname(pathname)
+        found = self.distros.get(dirpath, False)
+        if found is not False:
+            self.hits += 1
+            return found
+        return self._distro_of_dir(dirpath)
 
+    def _distro_of_dir(self, pathname):
+        """Climb from directory pathname to one known, or that tells the distribution, noting all those passed."""
 
-def distro_dir_and_name_from_src_filename(src_filename):
-    #def dirpath_and_distname(pathname):
-    """Give path to a srcfile, egg or directory, return its distribution directory and name.
-    """
-    pathname = src_filename  # keep original 'src_filename' value intact
+        self.misses += 1
+        distros = self.distros
+
+        chain = []  # directories passed, which share the answer of the one the climb ends at
+        while True:
+            if pathname in distros:
+                found = distros[pathname]
+                break
+            if pathname == '/':
+                found = distros[pathname] = None
+                break
 
-    pathname = os.path.abspath(pathname)  # convert partial names to full names
+            log.debug("DistributionName, pathname=%r", pathname)
+            chain.append(pathname)
 
-    while pathname != '/':
-        log.debug("DistributionName, pathname=%r", pathname)
+            ####
+            # To support the omelette recipe for buildout, which creates a
+            # map, using symlinks, to all source used in a project, follow any
+            # symlinks I find.
 
-        ####
-        # To support the omelette recipe for buildout, which creates a
-        # map, using symlinks, to all source used in a project, follow any
-        # symlinks I find.
+            if os.path.islink(pathname):
+                pathname = _follow_link(pathname)
+                log.debug("DistributionName, found symlink, switching to %r", pathname)
 
-        if os.path.islink(pathname):
-            pathname = os.readlink(pathname)
-            log.debug("DistributionName, found symlink, switching to %r", pathname)
+            found = _distro_here(pathname)
+            if found is not None:
+                break
 
-        ####
-        # To support buildout-cached eggs which unzips them, detect a
-        # file/directory name that ends with '.egg'.  If so, extract the
-        # distribution name from that directory name.
+            pathname, _ = os.path.split(pathname)  # ascend by stripping off a level of directory
 
-        if pathname.endswith('.egg'):
-            pathname, eggname = os.path.split(pathname)
-            log.debug("Found Distribution: %s", eggname.split('-', 1)[0])
-            return pathname, eggname.split('-', 1)[0]
+        for pathname in chain:
+            distros[pathname] = found
+        return found
 
-        ####
-        # To support the case of a development egg with a
-        # <DISTRIBUTION>.egg-info directory, as I ascend the directory
-        # hierarchy, look sideways to see if such a '*.egg-info' directory
-        # exists.
 
-        if os.path.isdir(pathname):
-            names = os.listdir(pathname)
-            infodirs = [name for name in names if name.endswith('.egg-info')]
-            if infodirs:
-                infodir = infodirs[0]  # assume there is only one
-                if os.path.isdir(os.path.join(pathname, infodir)):
-                    distname = infodir[:-len('.egg-info')]
-                    log.debug("Found Distribution %s in Directory %s", distname, pathname)
-                    return pathname, distname
+def _follow_link(pathname):
+    return os.path.normpath(os.path.join(os.path.dirname(pathname), os.readlink(pathname)))  # relative to the link
+
 
-        ####
-        # Finally detect if pathname is pointing into the Python Standard Library.
+def _distro_here(pathname):
+    """Return the distribution directory and name told by pathname itself, or None if it tells none."""
 
-        if os.path.isfile(os.path.join(pathname, '__future__.py')):
-            return pathname, "stdlib"
+    ####
+    # To support buildout-cached eggs which unzips them, detect a
+    # file/directory name that ends with '.egg'.  If so, extract the
+    # distribution name from that directory name.
 
-        pathname, _ = os.path.split(pathname)  # ascend by stripping off a level of directory
+    if pathname.endswith('.egg'):
+        dirpath, eggname = os.path.split(pathname)
+        log.debug("Found Distribution: %s", eggname.split('-', 1)[0])
+        return dirpath, eggname.split('-', 1)[0]
+
+    ####
+    # To support the case of a development egg with a
+    # <DISTRIBUTION>.egg-info directory, as I ascend the directory
+    # hierarchy, look sideways to see if such a '*.egg-info' directory
+    # exists.
+
+    if os.path.isdir(pathname):
+        names = os.listdir(pathname)
+        infodirs = [name for name in names if name.endswith('.egg-info')]
+        if infodirs:
+            infodir = infodirs[0]  # assume there is only one
+            if os.path.isdir(os.path.join(pathname, infodir)):
+                distname = infodir[:-len('.egg-info')]
+                log.debug("Found Distribution %s in Directory %s", distname, pathname)
+                return pathname, distname
+
+    ####
+    # Finally detect if pathname is pointing into the Python Standard Library.
+
+    if os.path.isfile(os.path.join(pathname, '__future__.py')):
+        return pathname, "stdlib"
+
+    return None
+
+
+def pkgname_from_src_filename(src_filename):
+    """Return the dotted package name of a srcfile or dir, worked out afresh; see DirectoryResolver to remember it."""
+
+    return DirectoryResolver().pkgname(src_filename)
+
+
+def distro_dir_and_name_from_src_filename(src_filename):
+    """Return the distribution directory and name of a srcfile, egg or directory, worked out afresh."""
 
-    return os.path.split(src_filename)[0], 'extralib'  # not an egg of any kind, nor in the standard library
+    return DirectoryResolver().distro(src_filename)
 
 
 def dottedname_uplevel(name, levels):
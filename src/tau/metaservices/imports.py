@@ -22,10 +22,11 @@ import inspect
 from collections import defaultdict
 from optparse import OptionParser
 
+from prunerules import add_prune_options, prune_rules_from_options
+import filesys_utils
+from distindex import DistributionIndex
 from filesys_utils import (
     walktrees,
-    pkgname_from_src_filename,
-    distro_dir_and_name_from_src_filename,
     dottedname_uplevel,
 )
 
@@ -75,6 +76,8 @@ class ImportsOptionParser(OptionParser):
                         action="store_true", dest="ignore_internal_imports", default=False,
                         help=("ignore imports within a package."))
 
+        add_prune_options(self)
+
 
 class DistributionNames(object):
     """Given a src pathname, figure out its distribution name, stash and return it.
@@ -85,16 +88,24 @@ class DistributionNames(object):
        The name is remembered to construct the set of all unique distribution
        names found, for reporting as desired.
 
+       Names are looked up first in a DistributionIndex, by default one built
+       from the metadata of the distributions on sys.path.  Files not in it
+       are placed by looking around them, by a DirectoryResolver, by default
+       one of its own, which remembers the answer for each directory.
+
        TBD: add support for stdlib detection
        TBD: should defaultdict be a set, not a list?
     """
 
-    def __init__(self):
+    def __init__(self, resolver=None, index=None):
         self._distros_seen = defaultdict(list)  # _distros_seen[DISTRO_NAME] = [LIST_OF_SRC_FILES]
+        self.resolver = resolver or filesys_utils.DirectoryResolver()
+        self.index = index if index is not None else DistributionIndex()
 
     def lookup(self, pathname):
         """  """
-        dirpath, distname = distro_dir_and_name_from_src_filename(pathname)
+        found = self.index.lookup(pathname)
+        dirpath, distname = found if found is not None else self.resolver.distro(pathname)
 
         if dirpath is not None and distname is not None:  # if I found a distro owning it,
 
@@ -376,6 +387,7 @@ class ImportsAstRecorder(ast.NodeVisitor):
 
     def __init__(self, import_occurrences):
         self.import_occurrences = import_occurrences
+        self.resolver = import_occurrences.distnames.resolver
 
     def visit(self, node, src_filename=None):
         """
@@ -383,7 +395,7 @@ class ImportsAstRecorder(ast.NodeVisitor):
 
         if src_filename is not None:
             if self.src_filename != src_filename:
-                self.pkgname = pkgname_from_src_filename(src_filename)
+                self.pkgname = self.resolver.pkgname(src_filename)
                 print "====> pkgname set to %r" % (self.pkgname, )
             self.src_filename = src_filename
 
@@ -469,7 +481,9 @@ def imports():
 
     # Do Static Analysis First and Accumulate Results
 
-    for pyfilename in walktrees(rootdirs=topdir, filepatts=('*.py', ), recurse=True):
+    aliases = {}  # first path to each directory or file reached by others -> the other paths
+    for pyfilename in walktrees(rootdirs=topdir, filepatts=('*.py', ), recurse=True, aliases=aliases,
+                                prune=prune_rules_from_options(options)):
         if options.verbose:
             logger.info("EVALUATING: ", pyfilename)
 
@@ -481,6 +495,10 @@ def imports():
                 tree = ast.parse(f.read(), filename=pyfilename)
                 walker.visit(tree, src_filename=pyfilename)
 
+    if options.verbose:
+        for path in sorted(aliases):
+            logger.info("SAME AS %s: %s", path, ' '.join(aliases[path]))
+
     # Now Optionally Run Dynamic Analysis to Refine Information
     if options.run:
         walker = ImportsRunRecorder(imports)
@@ -492,3 +510,6 @@ def imports():
 
     if options.static_imports:
         imports.report_found_imports(options)
+
+    if options.verbose:
+        logger.info("Directory lookups: %d hits, %d misses", distnames.resolver.hits, distnames.resolver.misses)
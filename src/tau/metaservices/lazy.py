@@ -0,0 +1,100 @@
+"""Module proxies whose code is run only on first use.
+"""
+
+import imp
+import sys
+
+from types import ModuleType
+
+from attributes import FallbackModule
+
+
+class LazyImportError(ImportError):
+    """The deferred loading of a lazily imported module failed."""
+
+
+class LazyModule(FallbackModule):
+    """Module whose code is run when a missing attribute is first looked up.
+
+       Until then it holds only __name__, __file__ and, for packages, __path__,
+       so the import machinery can use it without loading it.  Lookups of
+       names present in the module never reach __getattr__, so once loaded it
+       costs about as much to use as a regular module.  Names still missing
+       then are left to its __getattr__ function, if any, as a FallbackModule.
+    """
+
+    def __getattr__(self, name):
+        if name == '__path__':  # probed by the import machinery, and set if a package
+            raise AttributeError(name)
+
+        lazyload = self.__dict__.get('__lazyload__')
+        if lazyload is None:  # loaded already, so the name really is missing
+            return FallbackModule.__getattr__(self, name)
+
+        lazyload()
+        try:
+            return ModuleType.__getattribute__(self, name)
+        except AttributeError:
+            return FallbackModule.__getattr__(self, name)
+
+    def __repr__(self):
+        state = 'not loaded' if '__lazyload__' in self.__dict__ else 'loaded'
+        return "<lazy module %r from %r, %s>" % (self.__name__, self.__file__, state)
+
+
+def defer_load(name, stuff, load, locks=None):
+    """Return a LazyModule for name, which calls load(stuff) on first use.
+
+       The stuff is the (file, filename, info) triple of imp.find_module(), and
+       load() is expected to run the code of the module into the LazyModule
+       already in sys.modules.  Returns None if the module cannot be deferred.
+
+       The load is made holding the lock of the module in locks, a
+       ModuleLocks, or if None the global import lock.
+    """
+    file, filename, info = stuff
+    suffix, mode, type = info
+    if type not in (imp.PY_SOURCE, imp.PY_COMPILED, imp.PKG_DIRECTORY):
+        return None  # builtin and extension modules are loaded all at once
+
+    if file:
+        file.close()  # do not hold open a file for each module not yet loaded
+
+    m = LazyModule(name)
+    m.__file__ = filename
+    if type == imp.PKG_DIRECTORY:
+        m.__path__ = [filename]
+
+    loading = []  # non-empty while the code of the module runs
+
+    def lazyload():
+        if locks is None:
+            imp.acquire_lock()
+        else:
+            lock = locks.acquire(name)
+
+        try:
+            if '__lazyload__' not in m.__dict__ or loading:
+                return  # loaded by another thread meanwhile, or being loaded by this one
+
+            loading.append(True)
+            try:
+                load((open(filename, mode) if file else None, filename, info))
+            except Exception:
+                exc_type, exc, tb = sys.exc_info()
+                sys.modules[name] = m  # stay in place, so the next use tries again
+                raise LazyImportError, "Deferred import of module %r from %r failed: %s: %s" % (
+                    name, filename, exc_type.__name__, exc), tb
+            finally:
+                loading.pop()
+
+            del m.__dict__['__lazyload__']
+        finally:
+            if locks is None:
+                imp.release_lock()
+            elif lock is not None:
+                lock.release()
+
+    m.__lazyload__ = lazyload
+    sys.modules[name] = m
+    return m
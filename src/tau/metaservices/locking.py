@@ -0,0 +1,103 @@
+"""Per-module import locks, so threads importing different modules need not wait on each other.
+
+   Adapted from the module locks of importlib in Python 3.  Each module has
+   its own reentrant lock, held while it is being loaded.  A thread that would
+   deadlock waiting for a module lock, as when two threads each load one side
+   of a circular import, goes ahead without it and, just as a single thread
+   would, gets the module partially initialized.
+"""
+
+import thread
+
+
+class DeadlockError(RuntimeError):
+    pass
+
+
+class ModuleLock(object):
+    """A reentrant lock for one module, which refuses to wait if that would deadlock."""
+
+    def __init__(self, locks, name):
+        self.locks = locks
+        self.name = name
+        self.lock = thread.allocate_lock()    # guards the attributes below
+        self.wakeup = thread.allocate_lock()  # what waiting threads block on
+        self.owner = None
+        self.count = 0
+        self.waiters = 0
+
+    def has_deadlock(self):
+        """Whether the owner is, through other locks, waiting on the current thread."""
+
+        me = thread.get_ident()
+        tid = self.owner
+        seen = set()
+        while True:
+            lock = self.locks.blocking_on.get(tid)
+            if lock is None:
+                return False
+            tid = lock.owner
+            if tid == me:
+                return True
+            if tid in seen:
+                return False
+            seen.add(tid)
+
+    def acquire(self):
+        tid = thread.get_ident()
+        self.locks.blocking_on[tid] = self
+        try:
+            while True:
+                with self.lock:
+                    if self.count == 0 or self.owner == tid:
+                        self.owner = tid
+                        self.count += 1
+                        return
+                    if self.has_deadlock():
+                        raise DeadlockError("deadlock detected on import of %r" % (self.name, ))
+                    if self.wakeup.acquire(False):
+                        self.waiters += 1
+                self.wakeup.acquire()  # wait for the owner to be done with it
+                self.wakeup.release()
+        finally:
+            del self.locks.blocking_on[tid]
+
+    def release(self):
+        with self.lock:
+            if self.owner != thread.get_ident():
+                raise RuntimeError("cannot release un-acquired lock of module %r" % (self.name, ))
+            self.count -= 1
+            if self.count == 0:
+                self.owner = None
+                if self.waiters:
+                    self.waiters -= 1
+                    self.wakeup.release()
+
+
+class ModuleLocks(object):
+    """The locks of all modules, and the names of those being loaded right now."""
+
+    def __init__(self):
+        self.locks = {}        # module name -> ModuleLock
+        self.blocking_on = {}  # thread id -> ModuleLock it is waiting for
+        self.loading = {}      # module name -> number of loads of it under way
+
+    def acquire(self, name):
+        """Acquire the lock of module name, returning it, or None if that would deadlock."""
+
+        lock = self.locks.get(name)
+        if lock is None:
+            lock = self.locks.setdefault(name, ModuleLock(self, name))
+        try:
+            lock.acquire()
+        except DeadlockError:
+            return None
+        return lock
+
+    def start_loading(self, name):
+        self.loading[name] = self.loading.get(name, 0) + 1
+
+    def done_loading(self, name):
+        count = self.loading.pop(name) - 1
+        if count:
+            self.loading[name] = count
@@ -0,0 +1,121 @@
+"""Manifests of the modules a program imports, for loading them ahead of time.
+
+   A manifest is a text file naming one module per line, in the order their
+   loading completed, so each comes after the modules it imports.  Lines
+   starting with '#' are comments.
+"""
+
+import gc
+import sys
+
+from profiler import monotonic_clock
+
+
+class ManifestRecorder(object):
+    """Records the names of modules as their loading completes."""
+
+    def __init__(self):
+        self.initial = set(sys.modules)  # loaded before recording began, so left out
+        self.seen = set()
+        self.order = []
+
+    def loaded(self, name):
+        if name not in self.seen:
+            self.seen.add(name)
+            self.order.append(name)
+
+    def names(self):
+        """Return the module names recorded, with those loaded other than through the hook at the end."""
+
+        missed = sorted(name for name, m in sys.modules.items()
+                        if m is not None and name not in self.seen and name not in self.initial)
+        return [name for name in self.order if sys.modules.get(name) is not None] + missed
+
+    def write(self, filename):
+        names = self.names()
+        with open(filename, 'w') as f:
+            f.write("# import manifest of %d modules, written by tau.metaservices\n" % (len(names), ))
+            for name in names:
+                f.write(name + '\n')
+        return names
+
+
+def read_manifest(filename):
+    """Return the module names in manifest filename, in order."""
+
+    with open(filename) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+class PreloadReport(object):
+    """What importing the modules of a manifest did."""
+
+    def __init__(self):
+        self.loaded = []    # manifest entries imported, or already there
+        self.failed = {}    # manifest entry -> "ExceptionName: message"
+        self.extras = {}    # manifest entry -> [modules it pulled in that are not in the manifest]
+        self.seconds = 0.0
+        self.gc = None      # 'frozen' or 'disabled', if the garbage collector was set aside afterwards
+
+    def report(self, stream=None):
+        stream = stream or sys.stdout
+
+        print >>stream, "Preloaded %d modules in %.3fs, %d failed, %d pulled in %d unexpected modules" % (
+            len(self.loaded), self.seconds, len(self.failed),
+            len(self.extras), sum(len(extras) for extras in self.extras.values()))
+        for name in sorted(self.failed):
+            print >>stream, "  failed   %s: %s" % (name, self.failed[name])
+        for name in sorted(self.extras):
+            print >>stream, "  extras   %s: %s" % (name, ' '.join(self.extras[name]))
+
+
+def preload(names, freeze_gc=False):
+    """Import the modules named, in order, returning a PreloadReport.
+
+       Meant to be called in the master process of a pre-forking server, so
+       the modules are shared copy-on-write by the workers forked after.
+       With freeze_gc, the garbage collector is kept from touching, and so
+       copying, the objects created so far: by gc.freeze() where there is
+       one, and otherwise, as on Python 2, by collecting once and disabling
+       it, leaving it to the workers to call gc.enable() if they need it.
+    """
+    clock = monotonic_clock()
+    start = clock()
+
+    report = PreloadReport()
+    expected = set(names)
+    modules = sys.modules
+    known = set(modules)
+
+    for name in names:
+        was_loaded = name in modules
+        try:
+            __import__(name)
+        except Exception, exc:
+            report.failed[name] = "%s: %s" % (type(exc).__name__, exc)
+        else:
+            report.loaded.append(name)
+
+        added = not was_loaded and name in modules
+        if len(modules) == len(known) + added:  # nothing but the entry itself, the usual case
+            if added:
+                known.add(name)
+            continue
+
+        new = [other for other in modules if other not in known]
+        known = set(modules)
+        extras = sorted(other for other in new if other not in expected and modules[other] is not None)
+        if extras:
+            report.extras[name] = extras
+
+    if freeze_gc:
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+            report.gc = 'frozen'
+        else:
+            gc.disable()
+            report.gc = 'disabled'
+
+    report.seconds = clock() - start
+    return report
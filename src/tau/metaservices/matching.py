@@ -0,0 +1,151 @@
+"""Tables of values registered against dotted module names and patterns of them.
+"""
+
+import re
+import fnmatch
+
+
+class _Node(object):
+    """A node of the trie of pattern segments."""
+
+    __slots__ = ('children', 'globs', 'deep', 'entries')
+
+    def __init__(self):
+        self.children = {}  # literal segment -> _Node
+        self.globs = []     # [(compiled segment glob, _Node), ...]
+        self.deep = None    # _Node for a '**' segment
+        self.entries = []   # [(sequence no, value), ...] of patterns ending here
+
+
+class ModuleNameTable(object):
+    """Mapping of dotted module name patterns to values, in order of registration.
+
+       A pattern is a dotted module name, each segment of which may be
+
+         a name        -- matching just that segment, e.g. 'myapp'
+         a glob        -- matching one segment, e.g. '*' or 'view*'
+         '**'          -- matching any number of segments, including none
+
+       so 'myapp.views.*' matches the modules directly within myapp.views, and
+       'myapp.views.**' matches myapp.views and everything beneath it.
+
+       The patterns are kept in a trie keyed by segment, so a lookup only
+       visits the segments of the name looked up, however many patterns are
+       registered.  Results are cached per name until the table changes.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._patterns = {}  # pattern -> [(sequence no, value), ...]
+        self._sequence = 0
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __iter__(self):
+        return iter(self._patterns)
+
+    def __contains__(self, name):
+        return bool(self.lookup(name))
+
+    def patterns(self):
+        """Return the (pattern, value) pairs registered, in order of registration."""
+
+        entries = [(seq, pattern, value)
+                   for pattern, pairs in self._patterns.items() for seq, value in pairs]
+        return [(pattern, value) for _, pattern, value in sorted(entries)]
+
+    def add(self, pattern, value):
+        """Register another value for pattern, after any others registered."""
+
+        self._sequence += 1
+        entry = (self._sequence, value)
+
+        self._node(pattern).entries.append(entry)
+        self._patterns.setdefault(pattern, []).append(entry)
+        self._cache.clear()
+
+    def set(self, pattern, value):
+        """Register value as the only value for pattern."""
+
+        self.discard(pattern)
+        self.add(pattern, value)
+
+    def discard(self, pattern, value=None):
+        """Unregister value, or if None all values, for pattern."""
+
+        pairs = self._patterns.get(pattern)
+        if not pairs:
+            return
+
+        node = self._node(pattern)
+        kept = [pair for pair in pairs if value is not None and pair[1] != value]
+        node.entries[:] = [pair for pair in node.entries if pair in kept]
+
+        if kept:
+            self._patterns[pattern] = kept
+        else:
+            del self._patterns[pattern]
+        self._cache.clear()
+
+    def lookup(self, name):
+        """Return the values of all patterns matching name, in order of registration."""
+
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+
+        found = {}
+        self._collect(self._root, name.split('.'), 0, found)
+        values = self._cache[name] = tuple(found[seq] for seq in sorted(found))
+        return values
+
+    def last(self, name, default=None):
+        """Return the value of the most recently registered pattern matching name."""
+
+        values = self.lookup(name)
+        return values[-1] if values else default
+
+    def _collect(self, node, segments, i, found):
+        if node.deep is not None:  # '**' consumes none or more of the remaining segments
+            for j in xrange(i, len(segments) + 1):
+                self._collect(node.deep, segments, j, found)
+
+        if i == len(segments):
+            found.update(node.entries)
+            return
+
+        segment = segments[i]
+        child = node.children.get(segment)
+        if child is not None:
+            self._collect(child, segments, i + 1, found)
+
+        for glob, child in node.globs:
+            if glob.match(segment):
+                self._collect(child, segments, i + 1, found)
+
+    def _node(self, pattern):
+        """Return the trie node for pattern, creating it as needed."""
+
+        node = self._root
+        for segment in pattern.split('.'):
+            if segment == '**':
+                if node.deep is None:
+                    node.deep = _Node()
+                node = node.deep
+
+            elif any(c in segment for c in '*?['):
+                glob = re.compile(fnmatch.translate(segment))
+                for existing, child in node.globs:
+                    if existing.pattern == glob.pattern:
+                        break
+                else:
+                    child = _Node()
+                    node.globs.append((glob, child))
+                node = child
+
+            else:
+                node = node.children.setdefault(segment, _Node())
+        return node
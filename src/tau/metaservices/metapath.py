@@ -0,0 +1,220 @@
+"""PEP 302 import hooks for MetaServices, as an alternative to ihooks.
+
+   Rather than replacing __import__ and repeating the module search in Python,
+   a finder placed on sys.meta_path claims only those modules that have
+   something registered for them.  Every other import is left entirely to the
+   builtin machinery, along with its path importer cache.
+"""
+
+import os
+import imp
+import sys
+import logging
+
+from types import ModuleType
+
+from lazy import defer_load
+from attributes import with_fallback
+from blocklist import blocked
+
+log = logging.getLogger('tau.metaservices')
+
+
+def registered(table, fullname, package=None):
+    """Return the values registered in a ModuleNameTable for fullname.
+
+       Names are registered the way they are written in import statements,
+       so for an implicit relative import, made from within package, the
+       name relative to that package is tried too.  Any other import is
+       matched by its full name alone, as lazy imports and the blocklist are.
+    """
+    values = table.lookup(fullname)
+    if values or not package or not fullname.startswith(package + '.'):
+        return values
+    return table.lookup(fullname[len(package) + 1:])
+
+
+def package_of(globals):
+    """Return the name of the package the code running with globals is in, '' if none."""
+
+    package = globals.get('__package__')
+    if package is not None:
+        return package
+    name = globals.get('__name__') or ''
+    return name if '__path__' in globals else name.rpartition('.')[0]
+
+
+def importing_frame():
+    """Return the frame of the code whose import statement reached this module's finder or loader."""
+
+    frame = sys._getframe(1)
+    while frame.f_globals is globals():  # skip over this module's own frames
+        frame = frame.f_back
+    return frame
+
+
+class MetaPathFinder(object):
+    """Finder that claims modules which MetaServices subclasses or watches."""
+
+    def __init__(self, services):
+        self.services = services
+
+    def find_module(self, fullname, path=None):
+        services = self.services
+
+        if services.blocklist:
+            stubs = services.blocklist.lookup(fullname)
+            if stubs:
+                return BlockedLoader(services, stubs[-1])
+
+        package = package_of(importing_frame().f_globals) if '.' in fullname else None
+        if (services.profiler is None and services.manifest is None and services.dependencies is None and
+            not registered(services.import_subclasses, fullname, package) and
+            not registered(services.import_watchers, fullname, package) and
+            not registered(services.attribute_overrides, fullname, package) and
+            not registered(services.source_transforms, fullname, package) and
+            not services._is_lazy(fullname)):
+            return None  # nothing to do, let the builtin import handle it
+
+        try:
+            stuff = imp.find_module(fullname.rpartition('.')[2], path)
+        except ImportError:
+            return None  # not found here, maybe in a zip file or by a later finder
+
+        return MetaPathLoader(services, stuff, package)
+
+
+class BlockedLoader(object):
+    """Loader for a module on the blocklist, which may well not be there at all."""
+
+    def __init__(self, services, stub):
+        self.services = services
+        self.stub = stub
+
+    def load_module(self, fullname):
+        return blocked(self.services, fullname, self.stub, sys._getframe(1))
+
+
+class MetaPathLoader(object):
+    """Loader for one module found by MetaPathFinder."""
+
+    def __init__(self, services, stuff, package=None):
+        self.services = services
+        self.stuff = stuff
+        self.package = package  # of the code importing the module, for registered()
+
+    def load_module(self, fullname):
+        stats = self.services.stats
+        if stats is not None:
+            stats.hits[fullname] = stats.hits.get(fullname, 0) + 1
+
+        profiler = self.services.profiler
+        if profiler is None or fullname in sys.modules:
+            return self._load_module(fullname)
+
+        m = None
+        profiler.enter(fullname)
+        try:
+            m = self._load_module(fullname)
+        finally:
+            profiler.exit(loaded=m is not None)
+        return m
+
+    def _load_module(self, fullname):
+        services = self.services
+        modules = sys.modules
+
+        if fullname not in modules and services._is_lazy(fullname):
+            load = lambda stuff: services._loaded(fullname, self._exec(fullname, stuff), self.package)
+            m = defer_load(fullname, self.stuff, load)
+            if m is not None:
+                services.lazy_modules[fullname] = m
+                return self._after_load(fullname, m)
+
+        created = False
+        if fullname not in modules:
+            subclasses = registered(services.import_subclasses, fullname, self.package)
+            mod_cls = subclasses[-1] if subclasses else None
+            if services._has_fallback(registered(services.attribute_overrides, fullname, self.package)):
+                mod_cls = with_fallback(mod_cls or ModuleType)
+
+            if mod_cls is not None:  # imp.load_module() will execute into this module
+                log.debug("Given %r, returning a %r", fullname, mod_cls)
+                modules[fullname] = mod_cls(fullname)
+                created = True
+
+        file = self.stuff[0]
+        try:
+            m = self._exec(fullname, self.stuff)
+        except:
+            if created:
+                modules.pop(fullname, None)
+            raise
+        finally:
+            if file:
+                file.close()
+
+        return self._after_load(fullname, services._loaded(fullname, m, self.package))
+
+    def reload_module(self, fullname):
+        """Run the code of module fullname again, into the module already loaded, leaving out post-import handlers."""
+
+        file = self.stuff[0]
+        try:
+            return self.services._loaded(fullname, self._exec(fullname, self.stuff), self.package)
+        finally:
+            if file:
+                file.close()
+
+    def _exec(self, fullname, stuff):
+        """Load module fullname from stuff, through the source transforms registered for it if any."""
+
+        transforms = registered(self.services.source_transforms, fullname, self.package)
+        if transforms:
+            file, filename, (suffix, mode, type) = stuff
+            if type == imp.PY_SOURCE:
+                return self._exec_transformed(fullname, file, filename, None, transforms)
+            if type == imp.PKG_DIRECTORY and os.path.isfile(os.path.join(filename, '__init__.py')):
+                return self._exec_transformed(fullname, None, os.path.join(filename, '__init__.py'),
+                                              [filename], transforms)
+
+        return imp.load_module(fullname, *stuff)
+
+    def _exec_transformed(self, fullname, file, filename, path, transforms):
+        if file is None:
+            with open(filename, 'U') as f:
+                source = f.read()
+        else:
+            source = file.read()
+        code = self.services.transform_cache.code(filename, source, transforms)
+
+        modules = sys.modules
+        m = modules.get(fullname)
+        created = m is None
+        if created:
+            m = modules[fullname] = imp.new_module(fullname)
+        m.__file__ = filename
+        if path is not None:
+            m.__path__ = path
+
+        try:
+            exec code in m.__dict__
+        except:
+            if created:
+                modules.pop(fullname, None)
+            raise
+        return modules[fullname]
+
+    def _after_load(self, fullname, m):
+        services = self.services
+
+        dependencies = services.dependencies
+        watchers = registered(services.import_watchers, fullname, self.package)
+        if watchers or dependencies is not None:
+            frame = importing_frame()
+            if dependencies is not None and frame.f_code.co_name == '<module>' and '__name__' in frame.f_globals:
+                dependencies.add(frame.f_globals['__name__'], (fullname, ))
+            if watchers:  # call post-import handlers, on behalf of the importing frame
+                m = sys.modules[fullname] = services._after_import(fullname, watchers, m, frame)
+
+        return m
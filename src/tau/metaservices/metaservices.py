@@ -1,66 +1,956 @@
+import re
 import sys
 import ihooks
 import inspect
 import fnmatch
 import logging
+import threading
 
 from types import ModuleType
 
+from lazy import defer_load
+from attributes import with_fallback, apply_overrides
+from matching import ModuleNameTable
+from locking import ModuleLocks
+from profiler import ImportProfiler
+from stats import ImportStats
+from tracing import AttributeTracer
+from manifest import ManifestRecorder, read_manifest, preload
+from prefetch import Prefetcher
+from dircache import DirectoryCache
+from negcache import NegativeImportCache
+from transform import TransformCache, transform_version
+from blocklist import blocked
+from reloading import DependencyGraph, imported_names, reload_changed
+import multiproc
+from metapath import MetaPathFinder, registered, package_of
+
+log = logging.getLogger('tau.metaservices')
+
+
+class _ModuleImporter(ihooks.ModuleImporter):
+    """Module importer that locks each module it loads, and remembers failed implicit relative imports.
+
+       Like the builtin import, a name that resolved absolutely from inside a
+       package is recorded in sys.modules as None under its package-relative
+       name, so later imports of it need not search the package again.
+
+       Unlike the builtin import, which holds one lock for all imports, each
+       module is loaded holding a lock of its own, so threads wait only for
+       other threads loading the same modules.
+    """
+
+    def find_head_package(self, parent, name):
+        q, tail = ihooks.ModuleImporter.find_head_package(self, parent, name)
+        if parent:
+            qname = "%s.%s" % (parent.__name__, name.partition('.')[0])
+            if qname not in self.modules:  # found outside the package
+                self.modules[qname] = None
+        return q, tail
+
+    def import_it(self, partname, fqname, parent, force_load=0):
+        if not partname:
+            return parent
+
+        services = self.loader.services
+        locks = services.module_locks
+        if not force_load and fqname in self.modules and fqname not in locks.loading:
+            return self.modules[fqname]  # loaded already, whichever thread did it
+
+        if services.blocklist:
+            stubs = services.blocklist.lookup(fqname)
+            if stubs:
+                m = blocked(services, fqname, stubs[-1], sys._getframe(1))
+                if parent:
+                    setattr(parent, partname, m)
+                return m
+
+        negative_cache = services.negative_cache
+        if negative_cache is not None and negative_cache.known_missing(fqname, parent):
+            return None  # not found last time, nor will it be now
+
+        lock = locks.acquire(fqname)  # None if waiting would deadlock
+        try:
+            if not force_load and fqname in self.modules:
+                return self.modules[fqname]  # loaded meanwhile, or partially by this thread
+
+            locks.start_loading(fqname)
+            try:
+                m = self._load_it(partname, fqname, parent, force_load)
+            finally:
+                locks.done_loading(fqname)
+
+            if m is None and negative_cache is not None:
+                negative_cache.add(fqname, parent)
+            return m
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def _load_it(self, partname, fqname, parent, force_load):
+        profiler = self.loader.services.profiler
+        if profiler is None:
+            return ihooks.ModuleImporter.import_it(self, partname, fqname, parent, force_load)
+
+        m = None
+        profiler.enter(fqname)
+        try:
+            m = ihooks.ModuleImporter.import_it(self, partname, fqname, parent, force_load)
+        finally:
+            profiler.exit(loaded=m is not None)
+        return m
+
+
+class _ModuleLoader(ihooks.FancyModuleLoader):
+    """Module loader that leaves the loading of lazily imported modules for later.
+
+       It also searches directories by their listings in the DirectoryCache
+       of the services, if any, trying only the files that are there, and
+       opens the __init__ module of a package only to load it, so that the
+       Prefetcher of the services serves it then.
+    """
+
+    def __init__(self, hooks, services):
+        ihooks.FancyModuleLoader.__init__(self, hooks)
+        self.services = services
+
+    def find_module_in_dir(self, name, dir, allow_packages=1):
+        if dir is None:
+            return ihooks.FancyModuleLoader.find_module_in_dir(self, name, dir, allow_packages)
+
+        dircache = self.services.dircache
+        names = dircache.listing(dir) if dircache is not None else None
+
+        hooks = self.hooks
+        if allow_packages and (names is None or name in names):
+            fullname = hooks.path_join(dir, name)
+            if hooks.path_isdir(fullname) and self._is_package(fullname):
+                return None, fullname, ('', '', ihooks.PKG_DIRECTORY)
+
+        if names is None:
+            return ihooks.FancyModuleLoader.find_module_in_dir(self, name, dir, 0)
+
+        for info in hooks.get_suffixes():
+            filename = name + info[0]
+            if filename in names:
+                fullname = hooks.path_join(dir, filename)
+                try:
+                    return hooks.openfile(fullname, info[1]), fullname, info
+                except hooks.openfile_error:
+                    pass
+        return None
+
+    def _is_package(self, dirpath):
+        """Whether directory dirpath has an __init__ module, told from its listing or a stat, not by opening it as ihooks does."""
+
+        dircache = self.services.dircache
+        names = dircache.listing(dirpath) if dircache is not None else None
+        hooks = self.hooks
+        for suffix, mode, type in hooks.get_suffixes():
+            filename = '__init__' + suffix
+            if filename in names if names is not None else hooks.path_isfile(hooks.path_join(dirpath, filename)):
+                return True
+        return False
+
+    def load_module(self, name, stuff):
+        services = self.services
+        package = getattr(services.importing, 'package', None)
+        load = lambda stuff: services._loaded(name, self._load(name, stuff, package), package)
+
+        if services._is_lazy(name) and name not in self.modules_dict():  # not when reloading
+            m = defer_load(name, stuff, load, services.module_locks)
+            if m is not None:
+                services.lazy_modules[name] = m
+                return m
+
+        return load(stuff)
+
+    def _load(self, name, stuff, package=None):
+        """Load module name from stuff, through the source transforms registered for it if any."""
+
+        if self.services.source_transforms:
+            transforms = registered(self.services.source_transforms, name, package)
+            if transforms:
+                m = self._load_transformed(name, stuff, transforms)
+                if m is not None:
+                    return m
+
+        return ihooks.FancyModuleLoader.load_module(self, name, stuff)
+
+    def _load_transformed(self, name, stuff, transforms):
+        """Do as FancyModuleLoader.load_module() for a source module, or return None for any other."""
+
+        file, filename, (suff, mode, type) = stuff
+        path = None
+        if type == ihooks.PKG_DIRECTORY:
+            stuff = self.find_module_in_dir("__init__", filename, 0)
+            if not stuff:
+                return None
+            path = [filename]
+            file, filename, (suff, mode, type) = stuff
+            if type != ihooks.PY_SOURCE:
+                if file:
+                    file.close()
+                return None
+
+        elif type != ihooks.PY_SOURCE:
+            return None  # left to the base class, file and all
+
+        try:
+            source = file.read()
+        finally:
+            file.close()
+        code = self.services.transform_cache.code(filename, source, transforms)
+
+        m = self.hooks.add_module(name)
+        if path:
+            m.__path__ = path
+        m.__file__ = filename
+        try:
+            exec code in m.__dict__
+        except:
+            d = self.hooks.modules_dict()
+            if name in d:
+                del d[name]
+            raise
+        return m
+
+
+class _SubclassingHooks(ihooks.Hooks):
+    """Filesystem hooks that create new modules as instances of a ModuleType subclass."""
+
+    def __init__(self, mod_cls, services):
+        ihooks.Hooks.__init__(self)
+        self.mod_cls = mod_cls
+        self.services = services
+
+    def openfile(self, *args):
+        return self.services.openfile(*args)
+
+    def new_module(self, name):
+        log.debug("Given %r, returning a %r instead of a %r", name, self.mod_cls, ModuleType)
+        return self.mod_cls(name)   # instead of imp.new_module(name)
+
+
+class _ImportWatcher(object):
+    """A post-import handler, and the importing files it applies to."""
+
+    __slots__ = ('pattern', 'callfunc', 'filepatt', 'match', 'importers', 'shots')
+
+    def __init__(self, pattern, callfunc, filepatt=None, once_per_importer=False, once=False):
+        self.pattern = pattern
+        self.callfunc = callfunc
+        self.filepatt = filepatt
+        self.match = re.compile(fnmatch.translate(filepatt)).match if filepatt is not None else None
+        self.importers = {} if once_per_importer else None  # (modname, importing file) pairs already handled
+        self.shots = [True] if once else None               # emptied when a one-shot handler has fired
+
+
 class MetaServices(ihooks.Hooks):
-    """Collection of useful metaprogramming hooks and methods."""
+    """Collection of useful metaprogramming hooks and methods.
+
+       The hooks are applied by one of two backends:
+
+       'ihooks'   -- replaces __import__, and sees every import statement;
+                     post-import handlers run on each import of a module
+       'metapath' -- places a finder on sys.meta_path, and sees only the loading
+                     of modules with something registered for them;
+                     post-import handlers run once, when the module is loaded
+
+       The hooks take effect once installed, which registering any of them
+       does; uninstall() puts the import machinery back the way it was.
+
+       The 'ihooks' backend searches for modules using a DirectoryCache of
+       the directories on the path, unless dircache is False, as may suit
+       development, where files come and go within the second.  It also
+       remembers the modules it did not find in a NegativeImportCache, unless
+       negative_cache is False, to fail repeated imports of them at once.
+    """
+
+    backends = ('ihooks', 'metapath')
+
+    def __init__(self, backend='ihooks', dircache=True, negative_cache=True):
+        if backend not in self.backends:
+            raise ValueError("Unknown MetaServices backend %r, not one of %r" % (backend, self.backends))
 
-    def __init__(self):
         ihooks.Hooks.__init__(self)
-        self.import_subclasses = {}  # pre-import: mapping of modules to replacement classes
-        self.import_watchers = {}    # post-import: mapping of modules to adjustment functions
+        self.backend = backend
+        self.import_subclasses = ModuleNameTable()  # pre-import: mapping of modules to replacement classes
+        self.import_watchers = ModuleNameTable()    # post-import: mapping of modules to adjustment functions
+        self.subclass_importers = {}                # mapping of replacement classes to their module importers
+        self.lazy_patterns = ModuleNameTable()      # pre-import: patterns of modules to load on first use
+        self.lazy_modules = {}                      # mapping of names of lazily imported modules to their modules
+        self.attribute_overrides = ModuleNameTable()  # on load: mapping of modules to (overrides, fallback) pairs
+        self.source_transforms = ModuleNameTable()  # pre-compile: mapping of modules to (func, version) pairs
+        self.transform_cache = None                 # TransformCache of transformed code, once needed
+        self.blocklist = ModuleNameTable()          # pre-import: mapping of modules kept from loading to stubs, or None
+        self.blocked_imports = []                   # (module name, import chain) of each blocked import
+        self.child_counts = None                    # multiprocessing.Queue of counts sent back by children
+        self.importer_files = {}                    # mapping of the co_filename of code doing imports to its source file
+        self.relative_imports = {}                  # mapping of modules loaded by implicit relative imports to the package
+        self.importing = threading.local()          # package of the code importing in each thread, for the 'ihooks' backend
+        self.profiler = None                        # ImportProfiler timing module loads, if enabled
+        self.stats = None                           # ImportStats counting the work of the hooks, if enabled
+        self.dependencies = None                    # DependencyGraph of the modules imported, if tracked
+        self.tracked = False                        # whether stats or dependencies need every import seen
+        self.manifest = None                        # ManifestRecorder noting modules loaded, if recording
+        self.prefetcher = None                      # Prefetcher reading files ahead of imports, if started
+        self.dircache = DirectoryCache() if dircache else None  # listings answering the module search
+        self.negative_cache = NegativeImportCache() if negative_cache else None  # modules not found
+        self.module_locks = ModuleLocks()           # per-module locks held while loading, by the 'ihooks' backend
+        self.installed = False                      # whether imports are routed through this instance
+        self.saved_import = None                    # the __import__ replaced on install, by the 'ihooks' backend
+        self.passthrough = False                    # uninstalled, but still called by a hook installed over it
 
-        self.loader = ihooks.FancyModuleLoader(hooks=self)
-        self.importer = ihooks.ModuleImporter(self.loader)
+        self.loader = _ModuleLoader(self, self)
+        self.importer = _ModuleImporter(self.loader)
+        self.finder = MetaPathFinder(self)
 
     def __import__(self, modname, globals={}, locals={}, fromlist=[], level=-1):
+        if self.passthrough:  # uninstalled from under another hook, so just hand on the import
+            return self.saved_import(modname, globals, locals, fromlist, level)
+
+        if self.tracked:
+            return self._tracked_import(modname, globals, locals, fromlist, level)
+
+        watchers = self.import_watchers.lookup(modname)
+        if not watchers:  # fast path: no post-import handler to run
+            m = self._import_loaded(modname, globals, fromlist, level)
+            if m is not None:
+                return m
 
-        logging.debug("Wish to import module %r" % (modname, ))
-        if modname in self.import_subclasses:
-            mod_cls = self.import_subclasses[modname]
-            logging.debug("Remapping module to a subclass")
+        return self._import(modname, globals, locals, fromlist, level, watchers, None)
 
-            class SubclassingHooks(ihooks.Hooks):
-                def new_module(self, name):
-                    logging.debug("Given %r, returning a %r instead of a %r" % (name, mod_cls, ModuleType))
-                    return mod_cls(name)   # instead of imp.new_module(name)
+    def _tracked_import(self, modname, globals, locals, fromlist, level):
+        """Do what __import__ does, while recording it in the ImportStats and DependencyGraph, if any."""
 
-            loader = ihooks.FancyModuleLoader(hooks=SubclassingHooks())
-            importer = ihooks.ModuleImporter(loader)
+        stats = self.stats
+        if stats is not None:
+            stats.enter(modname)
+        try:
+            m = None
+            watchers = self.import_watchers.lookup(modname)
+            if not watchers:
+                m = self._import_loaded(modname, globals, fromlist, level)
+                if m is not None and stats is not None:
+                    stats.fastpath += 1
+
+            if m is None:
+                m = self._import(modname, globals, locals, fromlist, level, watchers, stats)
+        finally:
+            if stats is not None:
+                stats.exit()
+
+        dependencies = self.dependencies
+        if dependencies is not None:
+            frame = self._importing_frame()
+            if frame.f_code.co_name == '<module>' and '__name__' in frame.f_globals:
+                dependencies.add(frame.f_globals['__name__'], imported_names(modname, fromlist, m))
+        return m
+
+    def _import(self, modname, globals, locals, fromlist, level, watchers, stats):
+        """Import modname through the import machinery, then run its post-import handlers."""
+
+        mod_cls = self.import_subclasses.last(modname)
+        if self.attribute_overrides and self._has_fallback(self.attribute_overrides.lookup(modname)):
+            mod_cls = with_fallback(mod_cls or ModuleType)
+
+        if mod_cls is not None:
+            importer = self._subclass_importer(mod_cls)
         else:
             importer = self.importer
-            logging.debug("NOT Remapping module to a subclass")
 
-        m = importer.import_module(modname, globals, locals, fromlist)
-        logging.debug("Import module %r of type %r" % (modname, type(m)))
+        debug = log.isEnabledFor(logging.DEBUG)  # checked once, rather than formatting for nothing
+        if debug:
+            log.debug("Wish to import module %r, as a %r", modname, mod_cls or ModuleType)
+
+        importing = self.importing
+        saved_package = getattr(importing, 'package', None)
+        importing.package = package_of(globals) if globals else None
+        try:
+            if stats is None:
+                m = importer.import_module(modname, globals, locals, fromlist, level)
+            else:
+                m = stats.machinery(importer.import_module, modname, globals, locals, fromlist, level)
+        finally:
+            importing.package = saved_package
+
+        if debug:
+            log.debug("Import module %r of type %r", modname, type(m))
+
+        if watchers: # call post-import handlers
+            m = self._after_import(modname, watchers, m, self._importing_frame())
+
+        return m
+
+    def _after_import(self, modname, watchers, m, frame):
+        """Run post-import handlers of modname in turn, those that apply to the file importing from frame."""
+
+        stats = self.stats
+        importing_file = None
+        fired = False
+        for watcher in watchers:
+            if watcher.match is not None or watcher.importers is not None:
+                if importing_file is None:
+                    importing_file = self._importing_file(frame)
+
+                if watcher.match is not None and not watcher.match(importing_file):
+                    continue
+
+                if watcher.importers is not None:
+                    claim = object()  # setdefault() is atomic, so only one thread can win the claim
+                    if watcher.importers.setdefault((modname, importing_file), claim) is not claim:
+                        continue
+
+            if watcher.shots is not None:
+                try:
+                    watcher.shots.pop()  # atomic too, so a one-shot handler fires in one thread only
+                except IndexError:
+                    continue
+                self.import_watchers.discard(watcher.pattern, watcher)
+                fired = True
+
+            if stats is not None:
+                stats.watcher_called(watcher)
+            m = watcher.callfunc(m) or m
+
+        if fired and self._idle():
+            log.debug("All one-shot post-import handlers have fired, uninstalling")
+            self.uninstall()
+
+        return m
+
+    def _idle(self):
+        """Whether nothing remains registered that needs imports routed through this instance."""
+
+        return (not self.import_watchers and not self.import_subclasses and
+                not self.lazy_patterns and not self.attribute_overrides and not self.source_transforms and
+                not self.blocklist and
+                self.profiler is None and self.stats is None and self.manifest is None and
+                self.dependencies is None)
+
+    def _importing_frame(self):
+        """Return the frame of the code whose import statement is being run."""
 
-        if modname in self.import_watchers: # call post-import handlers
-            callfunc, filepatt = self.import_watchers[modname]
+        frame = sys._getframe(1)
+        while frame.f_globals is globals():  # skip over the frames of this hook
+            frame = frame.f_back
+        return frame
 
-            frame = sys._getframe(1)
+    def _importing_file(self, frame):
+        """Return the source file of the code running in frame, looking it up once per file compiled from."""
+
+        co_filename = frame.f_code.co_filename
+        try:
+            return self.importer_files[co_filename]
+        except KeyError:
             importing_file = inspect.getsourcefile(frame) or inspect.getfile(frame)
+            log.debug("Imports made from %r", importing_file)
+            self.importer_files[co_filename] = importing_file
+            return importing_file
+
+    def _import_loaded(self, modname, globals, fromlist, level):
+        """Return what __import__ would, if everything it needs is already loaded.
+
+           Follows the lookup order of the builtin __import__, including
+           implicit and explicit relative imports and the fromlist, but only
+           consults sys.modules.  Returns None whenever the builtin would have
+           to search for, load or complain about anything, so that the caller
+           can fall back to the full import machinery.
+        """
+        modules = sys.modules
+        head = modname.partition('.')[0]
+
+        pkgname = None
+        if globals and level:  # work out the package a relative import is based on
+            pkgname = globals.get('__package__')
+            if pkgname is None:
+                pkgname = globals.get('__name__')
+                if pkgname is None:
+                    return None
+                if '__path__' not in globals:
+                    pkgname = pkgname.rpartition('.')[0]
+            if level > 1:
+                segments = pkgname.rsplit('.', level - 1)
+                if len(segments) < level:
+                    return None  # beyond the top-level package, let the builtin raise
+                pkgname = segments[0]
+
+        if level > 0:      # explicit relative import, e.g. "from ..sibling import name"
+            if not pkgname or pkgname not in modules:
+                return None
+            if modname:
+                topname, fullname = pkgname + '.' + head, pkgname + '.' + modname
+            else:
+                topname = fullname = pkgname
+        else:
+            topname, fullname = head, modname
+            if pkgname:    # implicit relative import is tried first, unless known to fail
+                relative = modules.get(pkgname + '.' + head, False)
+                if relative is False:
+                    return None  # not yet attempted, have the full machinery decide
+                if relative is not None:
+                    topname, fullname = pkgname + '.' + head, pkgname + '.' + modname
 
-            logging.debug(importing_file)
+        m = modules.get(fullname)
+        if m is None:
+            return None
 
-            if filepatt is None or fnmatch.fnmatch(importing_file, filepatt):
-                m = callfunc(m) or m
+        loading = self.module_locks.loading
+        if loading and (fullname in loading or topname in loading):
+            return None  # partially initialized, have the full machinery wait for it
 
+        if not fromlist:
+            return modules.get(topname)
+
+        if hasattr(m, '__path__'):  # names in the fromlist may be submodules yet to import
+            for name in fromlist:
+                if name == '*':
+                    for name in getattr(m, '__all__', ()):
+                        if not hasattr(m, name):
+                            return None
+                elif not hasattr(m, name):
+                    return None
         return m
 
+    def _subclass_importer(self, mod_cls):
+        """Return the importer that creates modules of class mod_cls, building it only once."""
+
+        importer = self.subclass_importers.get(mod_cls)
+        if importer is None:
+            loader = _ModuleLoader(_SubclassingHooks(mod_cls, self), self)
+            importer = self.subclass_importers[mod_cls] = _ModuleImporter(loader)
+        return importer
+
+    def install(self):
+        """Make sure the import operation is routed through this instance."""
+
+        builtin = sys.modules['__builtin__']
+
+        if self.backend == 'metapath':
+            if self.finder not in sys.meta_path:
+                sys.meta_path.insert(0, self.finder)  # hook module loading
+
+        elif self.passthrough:  # still called by the hook installed over this one, so resume there
+            self.passthrough = False
+
+        elif builtin.__import__ != self.__import__:
+            self.saved_import = builtin.__import__
+            builtin.__import__ = self.__import__  # hook __import__ operation
+
+        self.installed = True
+
+    def uninstall(self):
+        """Stop routing the import operation through this instance, leaving other hooks in place.
+
+           If another hook has since replaced __import__ and calls this
+           instance in turn, this instance stays where it is in that chain,
+           merely handing every import on to the __import__ it replaced.
+           Instances left so are taken out when those over them are.
+        """
+        builtin = sys.modules['__builtin__']
+
+        if self.backend == 'metapath':
+            if self.finder in sys.meta_path:
+                sys.meta_path.remove(self.finder)
+
+        elif builtin.__import__ == self.__import__:
+            if self.saved_import is not None:
+                builtin.__import__ = _unwind_passthrough(self.saved_import)
+
+        elif self.installed:
+            self.passthrough = True
+
+        self.installed = False
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.uninstall()
+
     def subclass_module(self, modname, cls):
-        if sys.modules['__builtin__'].__import__ != self.__import__:
-            sys.modules['__builtin__'].__import__ = self.__import__  # hook __import__ operation
+        self.install()
+
+        log.debug("Adding mapping of modulename %r to class %r", modname, cls)
+        if self.backend == 'ihooks':
+            self._subclass_importer(cls)
+        self.import_subclasses.set(modname, cls)
+
+    def subclass_modules(self, mapping):
+        """Register many modulename (or pattern) to class mappings at once, given a dict or pairs."""
+
+        if hasattr(mapping, 'items'):
+            mapping = mapping.items()
+
+        for modname, cls in mapping:
+            if self.backend == 'ihooks':
+                self._subclass_importer(cls)
+            self.import_subclasses.set(modname, cls)
+
+        self.install()
+
+    def trace_attributes(self, modname, sample=100, filename=None, interval=None):
+        """Count a sample of the attribute reads from modules matching modname, returning the AttributeTracer.
+
+           The modules are created as instances of the module class of the
+           tracer, as by subclass_module(); see AttributeTracer for the rest.
+        """
+        tracer = AttributeTracer(sample, filename, interval)
+        self.subclass_module(modname, tracer.module_class)
+        return tracer
+
+    def call_after_import_of(self, modname, callfunc, from_filepatt=None, once_per_importer=False, once=False):
+        """Call callfunc(module) after an import of modname, or of modules matching it as a pattern.
+
+           Several functions may watch the same module; they are called in
+           the order they were registered, each given the module returned by
+           the one before.  With from_filepatt, only imports made from source
+           files matching that glob count, and with once_per_importer, only
+           the first import made from each source file does.
+
+           With once, callfunc is unregistered after its first call, and when
+           the last such one-shot handler has been called with nothing else
+           left registered, this instance uninstalls itself.
+        """
+        self.install()
+
+        self.import_watchers.add(modname, _ImportWatcher(modname, callfunc, from_filepatt, once_per_importer, once))
+
+    def lazy_import(self, pattern):
+        """Defer running the code of modules whose full dotted names match pattern until first used.
+
+           The pattern is that of a ModuleNameTable, e.g. 'myapp.reports.**'.
+           Such a module is imported as a LazyModule, which loads itself when
+           an attribute it does not yet have is looked up.  A failed deferred
+           load raises a LazyImportError there and then.
+        """
+        self.install()
+
+        self.lazy_patterns.set(pattern, True)
+
+    def override_attributes(self, modname, overrides=None, fallback=None):
+        """Set attributes of modules matching modname once loaded, and supply those they lack.
+
+           The attributes in the dict overrides are set once, right after the
+           code of the module has run, so reading them later costs nothing
+           extra.  The function fallback is called as fallback(name) only for
+           names the module lacks, like a module-level __getattr__ of PEP 562,
+           to return a value or raise AttributeError; the module is created as
+           a FallbackModule for it, with fallback as its __getattr__.  Either
+           way, only modules loaded after registering are affected.
+        """
+        self.install()
+
+        self.attribute_overrides.add(modname, (dict(overrides or {}), fallback))
+
+    def block_imports(self, blocklist):
+        """Keep the modules of blocklist from loading, given as patterns of full dotted names.
+
+           The blocklist is a sequence of patterns, or a dict or pairs mapping
+           patterns to stubs.  A module matching a pattern without a stub
+           fails to import with a BlockedImportError, at once; one with a stub
+           is replaced by it, as described by blocklist.make_stub().  Either
+           way, a warning is logged naming the modules whose code asked for it,
+           and the import is noted in blocked_imports.  Modules loaded
+           already are left alone.
+        """
+        if hasattr(blocklist, 'items'):
+            blocklist = blocklist.items()
+
+        for entry in blocklist:
+            pattern, stub = (entry, None) if isinstance(entry, basestring) else entry
+            self.blocklist.set(pattern, stub)
+
+        self.install()
+
+    def transform_source(self, modname, func, version=None, cache_dir=None):
+        """Have func alter the AST of modules matching modname before they are compiled.
+
+           The func is called as func(tree), given the ast.Module of the
+           source, and returns the tree to compile, or None having altered the
+           one given.  Several funcs apply in the order registered.  The code
+           compiled is kept in a TransformCache, in cache_dir or a directory
+           under ~/.cache, keyed by the source and version, which defaults to
+           a hash of the code of func; give one explicitly if func depends on
+           other code that may change.  Only modules loaded from source files,
+           after registering, are transformed.
+        """
+        self.install()
+
+        if cache_dir is not None or self.transform_cache is None:
+            self.transform_cache = TransformCache(cache_dir)
+        self.source_transforms.add(modname, (func, version or transform_version(func)))
+
+    def _has_fallback(self, registrations):
+        return any(fallback is not None for overrides, fallback in registrations)
+
+    def _loaded(self, name, m, package=None):
+        """Apply the attribute overrides for module name to it, just loaded, returning it.
+
+           The module is imported from within package, if given, so may be
+           matched by its name relative to it; see registered().
+        """
+        if package and name.startswith(package + '.'):
+            self.relative_imports[name] = package  # for a reload to match it the same
+
+        if self.attribute_overrides:
+            for overrides, fallback in registered(self.attribute_overrides, name, package):
+                apply_overrides(m, overrides, fallback)
+        if self.manifest is not None:
+            self.manifest.loaded(name)
+        if self.prefetcher is not None:
+            self.prefetcher.loaded(name)
+        return m
+
+    def openfile(self, *args):
+        """Open a file for the 'ihooks' backend, from the buffers of the Prefetcher if it has read it."""
+
+        if self.prefetcher is not None:
+            f = self.prefetcher.open(*args)
+            if f is not None:
+                return f
+        return open(*args)
+
+    def _is_lazy(self, name):
+        return name in self.lazy_patterns
+
+    def load_lazy_modules(self, pattern='**'):
+        """Load now those lazily imported modules matching pattern, returning their names."""
+
+        patterns = ModuleNameTable()
+        patterns.add(pattern, True)
+
+        loaded = []
+        for name in sorted(self.lazy_modules):
+            m = self.lazy_modules[name]
+            if name in patterns and '__lazyload__' in m.__dict__:
+                m.__dict__['__lazyload__']()
+                loaded.append(name)
+        return loaded
+
+    def unloaded_lazy_modules(self):
+        """Return the names of the lazily imported modules that have not been used so far."""
+
+        return sorted(name for name, m in self.lazy_modules.items() if '__lazyload__' in m.__dict__)
+
+    def enable_profiling(self):
+        """Start timing module loads, returning the ImportProfiler recording them.
+
+           With the 'metapath' backend, every module found by imp.find_module()
+           is then loaded through this instance, so it can be timed.
+        """
+        self.install()
+
+        if self.profiler is None:
+            self.profiler = ImportProfiler()
+        return self.profiler
+
+    def disable_profiling(self):
+        """Stop timing module loads, returning the ImportProfiler that recorded them."""
+
+        profiler, self.profiler = self.profiler, None
+        return profiler
+
+    def enable_stats(self):
+        """Start counting imports and post-import handler calls, returning the ImportStats doing so.
+
+           With the 'metapath' backend, only the loads of modules claimed by
+           its finder are seen, and no time is measured.
+        """
+        self.install()
+
+        if self.stats is None:
+            caches = {'dircache': self.dircache, 'negative_cache': self.negative_cache}
+            self.stats = ImportStats(dict((name, cache) for name, cache in caches.items() if cache is not None))
+            self.tracked = True
+        return self.stats
+
+    def disable_stats(self):
+        """Stop counting, returning the ImportStats that counted."""
+
+        stats, self.stats = self.stats, None
+        self.tracked = self.dependencies is not None
+        return stats
+
+    def track_dependencies(self):
+        """Start following which modules import which, returning the DependencyGraph doing so.
+
+           The sources of the modules loaded so far are taken as those they
+           were loaded from.  With the 'metapath' backend, only the import
+           that first loads a module is seen, not those made of it after.
+        """
+        self.install()
+
+        if self.dependencies is None:
+            self.dependencies = DependencyGraph()
+            self.tracked = True
+        return self.dependencies
+
+    def stop_tracking_dependencies(self):
+        """Stop following imports, returning the DependencyGraph that did."""
+
+        dependencies, self.dependencies = self.dependencies, None
+        self.tracked = self.stats is not None
+        return dependencies
+
+    def reload_changed(self):
+        """Reload the modules whose sources changed since loaded, and those importing them, returning a ReloadReport.
+
+           Modules are reloaded after those they import, then their
+           post-import handlers are run again, all but the one-shot ones.
+           Only the imports made since track_dependencies() are known.
+        """
+        if self.dependencies is None:
+            raise ValueError("Dependencies are not tracked, see track_dependencies()")
+        return reload_changed(self, self.dependencies)
+
+    def _reload(self, m):
+        """Run the code of module m again, into m, through the hooks of the backend."""
+
+        name = m.__name__
+        package = self.relative_imports.get(name)
+        if self.backend == 'ihooks':
+            importing = self.importing
+            saved_package, importing.package = getattr(importing, 'package', None), package
+            try:
+                return self.importer.reload(m)
+            finally:
+                importing.package = saved_package
+
+        parent = sys.modules[name.rpartition('.')[0]] if '.' in name else None
+        loader = self.finder.find_module(name, getattr(parent, '__path__', None))
+        if loader is None:
+            raise ImportError("Module %s not found for reload" % name)
+        loader.package = package
+        return loader.reload_module(name)
+
+    def _rerun_watchers(self, name, m):
+        """Run the post-import handlers of module name again, after it was reloaded."""
+
+        stats = self.stats
+        for watcher in registered(self.import_watchers, name, self.relative_imports.get(name)):
+            if watcher.shots is not None:
+                continue  # has not fired yet, and is left to fire on an import
+            if stats is not None:
+                stats.watcher_called(watcher)
+            m = watcher.callfunc(m) or m
+        if m is not sys.modules[name]:
+            sys.modules[name] = m
+
+    def record_manifest(self):
+        """Start noting the modules loaded, returning the ManifestRecorder doing so.
+
+           Modules are noted as their loading completes, so that a manifest
+           written by the recorder lists each after those it imports.  With
+           the 'metapath' backend, every module found by imp.find_module() is
+           then loaded through this instance, as when profiling.
+        """
+        self.install()
+
+        if self.manifest is None:
+            self.manifest = ManifestRecorder()
+        return self.manifest
+
+    def stop_manifest(self, filename=None):
+        """Stop noting the modules loaded, writing the manifest to filename if given; returns the ManifestRecorder."""
+
+        manifest, self.manifest = self.manifest, None
+        if manifest is not None and filename is not None:
+            manifest.write(filename)
+        return manifest
+
+    def preload_manifest(self, filename, freeze_gc=False):
+        """Import the modules of manifest filename, e.g. before forking workers; returns a PreloadReport.
+
+           See manifest.preload() for freeze_gc.
+        """
+        return preload(read_manifest(filename), freeze_gc)
+
+    def prefetch_manifest(self, filename, threads=4, max_bytes=64 << 20):
+        """Start reading the files of the modules of manifest filename ahead of their imports; returns the Prefetcher.
+
+           With the 'ihooks' backend, source files are kept in memory, up to
+           max_bytes, and loaded from there; otherwise the files are read only
+           into the page cache.  See the Prefetcher.
+        """
+        self.stop_prefetch()
+
+        ihooks_backend = self.backend == 'ihooks'
+        if ihooks_backend:
+            self.install()
+
+        self.prefetcher = Prefetcher(read_manifest(filename), threads,
+                                     max_bytes if ihooks_backend else 0, prefer_source=ihooks_backend)
+        return self.prefetcher
+
+    def stop_prefetch(self):
+        """Stop reading files ahead, dropping what has been read; returns the Prefetcher, if any."""
+
+        prefetcher, self.prefetcher = self.prefetcher, None
+        if prefetcher is not None:
+            prefetcher.stop()
+        return prefetcher
+
+    def forget_failed_imports(self):
+        """Have modules that could not be found searched for again, as after adding files to the path."""
+
+        if self.negative_cache is not None:
+            self.negative_cache.clear()
+
+    def registrations(self):
+        """Return what is registered with this instance, as a dict that pickles if the values registered do."""
+
+        return multiproc.registrations(self)
+
+    from_registrations = staticmethod(multiproc.from_registrations)
+
+    def pool_initializer(self):
+        """Return the (initializer, initargs) for a multiprocessing.Pool to have these hooks in its workers.
+
+           Workers started afresh get the registrations set up again, forked
+           ones keep those they inherit, and all send the stats and profile
+           records they gather back as they exit, for collect_child_counts().
+        """
+        if self.child_counts is None:
+            import multiprocessing
+            self.child_counts = multiprocessing.Queue()
+        return multiproc.child_initializer, (self.registrations(), self.child_counts)
+
+    def collect_child_counts(self, timeout=0.1):
+        """Merge into the stats and profile of this instance those sent by children that have exited.
+
+           Returns the number of children whose counts were merged, waiting
+           up to timeout seconds for each.
+        """
+        import Queue
 
-        logging.debug("Adding mapping of modulename %r to class %r" % (modname, cls))
-        self.import_subclasses[modname] = cls
+        merged = 0
+        while self.child_counts is not None:
+            try:
+                pid, stats, records = self.child_counts.get(True, timeout)
+            except Queue.Empty:
+                break
+            if stats is not None and self.stats is not None:
+                self.stats.merge(stats)
+            if records is not None and self.profiler is not None:
+                self.profiler.records.extend(records)
+            merged += 1
+        return merged
 
-    def call_after_import_of(self, modname, callfunc, from_filepatt=None):
 
-        if sys.modules['__builtin__'].__import__ != self.__import__:
-            sys.modules['__builtin__'].__import__ = self.__import__  # hook __import__ operation
+def _unwind_passthrough(saved_import):
+    """Return the __import__ to restore in place of saved_import, skipping the instances left passing imports through.
 
-        self.import_watchers[modname] = (callfunc, from_filepatt)
+       Such an instance was uninstalled from under the hook now uninstalled,
+       so goes out of the chain along with it.
+    """
+    while True:
+        below = getattr(saved_import, 'im_self', None)
+        if not (isinstance(below, MetaServices) and below.passthrough and saved_import == below.__import__):
+            return saved_import
+        below.passthrough = False
+        if below.saved_import is None:
+            return saved_import
+        saved_import = below.saved_import
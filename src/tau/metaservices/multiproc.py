@@ -0,0 +1,97 @@
+"""Carrying MetaServices registrations into multiprocessing children, and their counts back.
+
+   A forked child inherits the hooks of its parent along with the rest of
+   its memory, but a child started afresh, as multiprocessing does on
+   Windows, has none.  The initializer given by pool_initializer() sets the
+   registrations up again in the latter, and in both has the child send the
+   stats and profile it gathered back to the parent as it exits.
+"""
+
+import os
+import itertools
+
+_services = {}                  # token -> MetaServices whose registrations were taken, as inherited by a fork
+_tokens = itertools.count(1)
+
+
+def registrations(services):
+    """Return the registrations of services, as a dict that pickles if the values registered do."""
+
+    token = getattr(services, 'registrations_token', None)
+    if token is None:
+        token = services.registrations_token = (os.getpid(), next(_tokens))
+        _services[token] = services
+
+    transform_cache = services.transform_cache
+    return {
+        'token': token,
+        'backend': services.backend,
+        'dircache': services.dircache is not None,
+        'negative_cache': services.negative_cache is not None,
+        'subclasses': services.import_subclasses.patterns(),
+        'watchers': [(pattern, watcher.callfunc, watcher.filepatt, watcher.importers is not None,
+                      watcher.shots is not None) for pattern, watcher in services.import_watchers.patterns()],
+        'lazy': [pattern for pattern, _ in services.lazy_patterns.patterns()],
+        'attribute_overrides': services.attribute_overrides.patterns(),
+        'source_transforms': services.source_transforms.patterns(),
+        'transform_cache_dir': transform_cache.cache_dir if transform_cache is not None else None,
+        'blocklist': services.blocklist.patterns(),
+        'profiling': services.profiler is not None,
+        'stats': services.stats is not None,
+    }
+
+
+def from_registrations(spec):
+    """Return a new MetaServices, installed, with the registrations of spec from registrations()."""
+
+    from metaservices import MetaServices
+
+    services = MetaServices(spec['backend'], spec['dircache'], spec['negative_cache'])
+    services.subclass_modules(spec['subclasses'])
+    for pattern, callfunc, filepatt, once_per_importer, once in spec['watchers']:
+        services.call_after_import_of(pattern, callfunc, filepatt, once_per_importer, once)
+    for pattern in spec['lazy']:
+        services.lazy_import(pattern)
+    for pattern, (overrides, fallback) in spec['attribute_overrides']:
+        services.override_attributes(pattern, overrides, fallback)
+    for pattern, (func, version) in spec['source_transforms']:
+        services.transform_source(pattern, func, version, spec['transform_cache_dir'])
+    services.block_imports(spec['blocklist'])
+    if spec['profiling']:
+        services.enable_profiling()
+    if spec['stats']:
+        services.enable_stats()
+    services.install()
+    return services
+
+
+def child_initializer(spec, queue):
+    """Set up the hooks of spec in a child process, and send its counts to queue when it exits.
+
+       Given as the initializer of a multiprocessing.Pool, or called first
+       thing by the target of a multiprocessing.Process.
+    """
+    from multiprocessing.util import Finalize
+
+    services = _services.get(spec['token'])
+    if services is None:  # started afresh, not forked
+        services = from_registrations(spec)
+    else:  # forked, so count only what this child does
+        if services.profiler is not None:
+            services.disable_profiling()
+            services.enable_profiling()
+        if services.stats is not None:
+            services.disable_stats()
+            services.enable_stats()
+
+    _services[spec['token']] = services
+    Finalize(None, send_counts, (services, queue), exitpriority=10)
+    return services
+
+
+def send_counts(services, queue):
+    """Send the stats and profile records of services to the parent."""
+
+    stats = services.stats.as_dict() if services.stats is not None else None
+    records = services.profiler.records if services.profiler is not None else None
+    queue.put((os.getpid(), stats, records))
@@ -0,0 +1,45 @@
+"""Remembering the modules that could not be found, so looking for them again is quick.
+"""
+
+import sys
+
+
+class NegativeImportCache(object):
+    """Names of modules not found, with the path each was searched for on.
+
+       A name is known to be missing only while the path it was not found on
+       is the same: sys.path for a top-level module, the __path__ of its
+       package otherwise.  Any change to sys.path forgets every name, but
+       files added to directories already on the path are not noticed;
+       clear() forgets the names for that.
+    """
+
+    def __init__(self):
+        self.missing = {}            # module name -> tuple of the package __path__ searched, or None for sys.path
+        self.sys_path = list(sys.path)
+        self.hits = 0                # searches spared
+        self.misses = 0              # searches made
+
+    def known_missing(self, fqname, parent):
+        """Return whether module fqname was not found when last searched for within package parent, if any."""
+
+        if sys.path != self.sys_path:
+            self.clear()
+
+        if fqname in self.missing and self.missing[fqname] == self._path(parent):
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def add(self, fqname, parent):
+        self.missing[fqname] = self._path(parent)
+
+    def _path(self, parent):
+        path = getattr(parent, '__path__', None)
+        return tuple(path) if path is not None else None
+
+    def clear(self):
+        self.missing.clear()
+        self.sys_path = list(sys.path)
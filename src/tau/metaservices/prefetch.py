@@ -0,0 +1,139 @@
+"""Reading the files of modules about to be imported ahead of time, in background threads.
+"""
+
+import os
+import sys
+import imp
+import Queue
+import threading
+
+from cStringIO import StringIO
+
+
+class Prefetcher(object):
+    """Reads the files of the modules named, in order, ahead of their imports.
+
+       A few threads take the names in turn, find the file each will be
+       loaded from, by looking along sys.path, and read it.  Source files are
+       kept in memory, up to max_bytes in all, for open() to hand to the
+       loader of the 'ihooks' backend instead of reading the file again;
+       other files, such as bytecode and extension modules, are read only to
+       have them in the page cache when the import comes to them.  The
+       buffers of a module are dropped once it is loaded, and none are kept
+       of a module loaded before its thread came to it.
+    """
+
+    def __init__(self, names, threads=4, max_bytes=64 << 20, prefer_source=True):
+        self.max_bytes = max_bytes
+        self.prefer_source = prefer_source
+        self.buffers = {}     # filename -> contents, of source files of modules not yet loaded
+        self.files = {}       # module name -> filenames buffered for it
+        self.loaded_names = set()  # modules loaded, whose files are no longer to be buffered
+        self.buffered = 0     # bytes held in buffers
+        self.bytes_read = 0
+        self.files_read = 0
+        self.hits = 0         # opens answered from a buffer
+        self.lock = threading.Lock()  # guards the buffers and the counts of bytes
+
+        self.queue = Queue.Queue()
+        for name in names:
+            self.queue.put(name)
+
+        self.threads = [threading.Thread(target=self._work, name="Prefetcher %d" % (i, ))
+                        for i in range(threads)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def _work(self):
+        while True:
+            try:
+                name = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self._prefetch(name)
+            except (IOError, OSError):
+                pass  # the import will find out, and report it properly
+
+    def _prefetch(self, name):
+        filename, is_source = self._find(name)
+        if filename is None:
+            return
+
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        with self.lock:
+            self.bytes_read += len(data)
+            self.files_read += 1
+            if not is_source or self.buffered + len(data) > self.max_bytes or name in self.loaded_names:
+                return  # read only into the page cache
+            self.buffered += len(data)
+            self.buffers[filename] = data
+            self.files.setdefault(name, []).append(filename)
+
+    def _find(self, name):
+        """Return the file module name will most likely be loaded from, and whether it is source."""
+
+        relpath = os.path.join(*name.split('.'))
+        suffixes = [suffix for suffix, mode, type in imp.get_suffixes() if type != imp.PY_COMPILED]
+        if self.prefer_source:
+            suffixes += ['.pyc']
+        else:
+            suffixes.insert(0, '.pyc')
+
+        for entry in sys.path:
+            base = os.path.join(entry or os.curdir, relpath)
+            for base in (os.path.join(base, '__init__'), base):
+                for suffix in suffixes:
+                    filename = base + suffix
+                    if os.path.isfile(filename):
+                        return filename, suffix == '.py'
+        return None, False
+
+    def open(self, filename, mode='r'):
+        """Return a file-like object on the buffered contents of filename, or None if there are none.
+
+           Only text modes are answered, as bytecode is read by marshal.load(),
+           which wants a real file.
+        """
+        if 'b' in mode:
+            return None
+
+        with self.lock:
+            data = self.buffers.get(filename)
+            if data is None:
+                return None
+            self.hits += 1
+
+        if 'U' in mode and '\r' in data:
+            data = data.replace('\r\n', '\n').replace('\r', '\n')
+        return StringIO(data)
+
+    def loaded(self, name):
+        """Drop the buffers of module name, now that it is loaded, and buffer none of it from now on."""
+
+        with self.lock:
+            self.loaded_names.add(name)
+            for filename in self.files.pop(name, ()):
+                data = self.buffers.pop(filename, None)
+                if data is not None:
+                    self.buffered -= len(data)
+
+    def stop(self):
+        """Have the threads stop once done with the names they have taken, and drop all buffers."""
+
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+        for t in self.threads:
+            t.join()
+
+        with self.lock:
+            self.buffers.clear()
+            self.files.clear()
+            self.buffered = 0
@@ -0,0 +1,186 @@
+"""Hierarchical timing of module loads, for finding what makes startup slow.
+"""
+
+import sys
+import json
+import time
+import thread
+
+
+def monotonic_clock():
+    """Return a function giving the seconds of a clock that never goes backwards.
+
+       Python 2 has no time.monotonic(), so on Linux clock_gettime() is called
+       through ctypes, falling back to time.time() where that is unavailable.
+    """
+    global _clock
+
+    if _clock is None:
+        _clock = getattr(time, 'monotonic', None) or _linux_monotonic() or time.time
+    return _clock
+
+_clock = None
+
+
+def _linux_monotonic():
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        import ctypes
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        try:
+            clock_gettime = ctypes.CDLL('libc.so.6', use_errno=True).clock_gettime
+        except (OSError, AttributeError):  # glibc before 2.17 keeps it in librt
+            clock_gettime = ctypes.CDLL('librt.so.1', use_errno=True).clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    CLOCK_MONOTONIC = 1
+    ts = timespec()
+    ts_ref = ctypes.byref(ts)
+
+    def monotonic():
+        clock_gettime(CLOCK_MONOTONIC, ts_ref)
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    return monotonic
+
+
+class ImportNode(object):
+    """Time spent loading a module, and the modules loaded while doing so."""
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0       # seconds from start to end of the load(s)
+        self.own = 0.0        # seconds not spent in loads of children
+        self.count = 0        # number of loads, more than one only after reloads
+        self.children = {}    # module name -> ImportNode
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = ImportNode(name)
+        return node
+
+    def sorted_children(self):
+        return sorted(self.children.values(), key=lambda node: (-node.wall, node.name))
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'wall': self.wall,
+            'self': self.own,
+            'children': [node.as_dict() for node in self.sorted_children()],
+        }
+
+
+class ImportProfiler(object):
+    """Records the wall and self time of each module load, nested by what loaded what.
+
+       While a load is in progress only a small list sits on a stack, one
+       per thread; the tree is put together from the finished records when
+       reporting.
+    """
+
+    def __init__(self):
+        self.clock = monotonic_clock()
+        self.stacks = {}   # thread id -> [[name, start, seconds spent in child loads], ...]
+        self.records = []  # [(stack of names, wall seconds, self seconds), ...]
+
+    def enter(self, name):
+        tid = thread.get_ident()
+        stack = self.stacks.get(tid)
+        if stack is None:
+            stack = self.stacks[tid] = []
+        stack.append([name, self.clock(), 0.0])
+
+    def exit(self, loaded=True):
+        """End the innermost load, recording it unless nothing was loaded after all."""
+
+        end = self.clock()
+        stack = self.stacks[thread.get_ident()]
+        name, start, in_children = stack.pop()
+        wall = end - start
+
+        if not loaded:  # a failed search, charged to whoever was looking
+            return
+
+        if stack:
+            stack[-1][2] += wall
+
+        path = tuple(frame[0] for frame in stack) + (name, )
+        self.records.append((path, wall, wall - in_children))
+
+    def tree(self):
+        """Return the root ImportNode of the tree of loads recorded so far."""
+
+        root = ImportNode('<root>')
+        for path, wall, own in self.records:
+            node = root
+            for name in path:
+                node = node.child(name)
+            node.wall += wall
+            node.own += own
+            node.count += 1
+            if len(path) == 1:
+                root.wall += wall
+        return root
+
+    def totals(self):
+        """Return {module name: [wall seconds, self seconds, loads]} summed over all places loaded."""
+
+        totals = {}
+        for path, wall, own in self.records:
+            total = totals.setdefault(path[-1], [0.0, 0.0, 0])
+            total[0] += wall
+            total[1] += own
+            total[2] += 1
+        return totals
+
+    def report_tree(self, stream=None, min_wall=0.0):
+        """Print the cumulative tree of loads, the slowest first, omitting those under min_wall seconds."""
+
+        stream = stream or sys.stdout
+
+        def show(node, depth):
+            for child in node.sorted_children():
+                if child.wall < min_wall:
+                    continue
+                print >>stream, "%9.3fms %9.3fms  %s%s" % (
+                    child.wall * 1e3, child.own * 1e3, '  ' * depth, child.name)
+                show(child, depth + 1)
+
+        print >>stream, "%11s %11s  %s" % ("wall", "self", "module")
+        show(self.tree(), 0)
+
+    def report_top(self, limit=20, stream=None):
+        """Print the limit modules whose loading took the most time of their own."""
+
+        stream = stream or sys.stdout
+
+        totals = sorted(self.totals().items(), key=lambda (name, total): (-total[1], name))
+
+        print >>stream, "%11s %11s %6s  %s" % ("self", "wall", "loads", "module")
+        for name, (wall, own, count) in totals[:limit]:
+            print >>stream, "%9.3fms %9.3fms %6d  %s" % (own * 1e3, wall * 1e3, count, name)
+
+    def write_collapsed(self, stream):
+        """Write the loads in the collapsed-stack format read by flamegraph.pl, in microseconds of self time."""
+
+        collapsed = {}
+        for path, wall, own in self.records:
+            key = ';'.join(path)
+            collapsed[key] = collapsed.get(key, 0.0) + own
+
+        for key in sorted(collapsed):
+            stream.write("%s %d\n" % (key, round(collapsed[key] * 1e6)))
+
+    def write_json(self, stream):
+        """Write the tree of loads as JSON, with times in seconds."""
+
+        json.dump(self.tree().as_dict(), stream, indent=1, sort_keys=True)
@@ -0,0 +1,169 @@
+"""Rules in the manner of .gitignore of the directories and files a walk of directory trees leaves out.
+"""
+
+import re
+
+
+def translate(pattern):
+    """Return the regex source matching the relative paths that gitignore-style pattern does, sans anchoring."""
+
+    parts = pattern.split('/')
+    out = []
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == '**':
+            out.append('.*' if last else '(?:.*/)?')  # everything within, or any number of directories
+        else:
+            out.append(_translate_segment(part) + ('' if last else '/'))
+    return ''.join(out)
+
+
+def _translate_segment(segment):
+    """Return the regex source of a pattern within one path segment, where no wildcard matches a slash."""
+
+    i, n = 0, len(segment)
+    out = []
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            while i < n and segment[i] == '*':
+                i += 1
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '\\' and i < n:
+            out.append(re.escape(segment[i]))
+            i += 1
+        elif c == '[':
+            j = i
+            if j < n and segment[j] in '!^':
+                j += 1
+            if j < n and segment[j] == ']':
+                j += 1
+            while j < n and segment[j] != ']':
+                j += 1
+            if j >= n:  # no closing bracket, so a plain one
+                out.append('\\[')
+            else:
+                stuff = segment[i:j].replace('\\', '\\\\')
+                if stuff[0] in '!^':
+                    stuff = '^' + stuff[1:]
+                out.append('[%s]' % stuff)
+                i = j + 1
+        else:
+            out.append(re.escape(c))
+    return ''.join(out)
+
+
+class PruneRules(object):
+    """Gitignore-style rules of what to leave out of a walk, compiled into a regex for directories and one for files.
+
+       Rules are matched against paths relative to the root of the walk,
+       separated by '/'.  As in a .gitignore file:
+
+       - blank lines and lines starting with '#' are no rules
+       - a rule starting with '!' takes back what an earlier rule left out
+       - a rule ending in '/' matches directories only
+       - a rule with a '/' at its start or middle matches from the root down,
+         any other at every level of the tree
+       - '*', '?' and '[...]' match within a path segment, '**' across them
+
+       The last rule matching a path decides.  A directory left out is not
+       walked, so nothing within it can be taken back, also as in git.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []   # (rule, regex source, negated, directories only) of each rule, in order
+        self.add(rules)
+
+    @classmethod
+    def from_file(cls, filename):
+        """Return the rules in an ignore file, such as a .gitignore."""
+
+        with open(filename) as f:
+            return cls(f)
+
+    def add(self, rules):
+        """Add rules, lines of an ignore file, after those there are."""
+
+        if isinstance(rules, basestring):
+            rules = (rules, )
+
+        for rule in rules:
+            pattern = rule.rstrip('\r\n')
+            if pattern.endswith(' ') and not pattern.endswith('\\ '):  # trailing spaces, unless escaped
+                pattern = pattern.rstrip(' ')
+            if not pattern or pattern.startswith('#'):
+                continue
+
+            negated = pattern.startswith('!')
+            if negated:
+                pattern = pattern[1:]
+            dirs_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if not pattern:
+                continue
+
+            if '/' in pattern:  # anchored to the root of the walk
+                source = translate(pattern.lstrip('/'))
+            else:
+                source = '(?:.*/)?' + translate(pattern)
+            self.rules.append((rule.rstrip('\r\n'), source, negated, dirs_only))
+
+        self._compile()
+
+    def _compile(self):
+        """Join the rules into one regex per kind of path, trying the last rule first."""
+
+        self.dir_match, self.dir_negated = self._join(self.rules)
+        self.file_match, self.file_negated = self._join([rule for rule in self.rules if not rule[3]])
+
+    def _join(self, rules):
+        if not rules:
+            return None, ()
+        rules = rules[::-1]  # alternatives are tried in order, so the first to match is the last rule
+        regex = re.compile('|'.join('(%s)\\Z' % source for _, source, _, _ in rules))
+        return regex.match, (None, ) + tuple(negated for _, _, negated, _ in rules)
+
+    def __nonzero__(self):
+        return bool(self.rules)
+
+    def prunes_dir(self, relpath):
+        """Whether the directory at relpath, relative to the root of the walk, is left out."""
+
+        if self.dir_match is None:
+            return False
+        m = self.dir_match(relpath)
+        return m is not None and not self.dir_negated[m.lastindex]
+
+    def prunes_file(self, relpath):
+        """Whether the file at relpath, relative to the root of the walk, is left out."""
+
+        if self.file_match is None:
+            return False
+        m = self.file_match(relpath)
+        return m is not None and not self.file_negated[m.lastindex]
+
+
+def add_prune_options(parser):
+    """Add the options giving prune rules to an OptionParser of a console script."""
+
+    parser.add_option("--prune",
+                      action="append", dest="prune", default=[], metavar="RULE",
+                      help="leave out the directories and files matching this .gitignore-style rule")
+
+    parser.add_option("--prune-from",
+                      action="append", dest="prune_from", default=[], metavar="FILE",
+                      help="leave out what the rules of this ignore file, e.g. a .gitignore, match")
+
+
+def prune_rules_from_options(options):
+    """Return the PruneRules given by the options of add_prune_options(), those of files first."""
+
+    rules = PruneRules()
+    for filename in options.prune_from:
+        with open(filename) as f:
+            rules.add(f)
+    rules.add(options.prune)
+    return rules
@@ -0,0 +1,209 @@
+"""Following which modules import which, to reload those whose sources changed along with their importers.
+"""
+
+import os
+import sys
+import logging
+
+from types import ModuleType
+
+from profiler import monotonic_clock
+
+log = logging.getLogger('tau.metaservices')
+
+
+def source_file(m):
+    """Return the source file module m was loaded from, or None if it has none that reloading would read."""
+
+    filename = getattr(m, '__file__', None)
+    if not filename or '__lazyload__' in m.__dict__:  # a lazy module not yet loaded has nothing to reload
+        return None
+    if hasattr(m, '__path__') and os.path.isdir(filename):  # a package, as loaded by ihooks
+        filename = os.path.join(filename, '__init__.py')
+    if filename.endswith(('.pyc', '.pyo')):
+        filename = filename[:-1]
+    return filename if filename.endswith('.py') else None
+
+
+def source_mtime(m):
+    filename = source_file(m)
+    if filename is None:
+        return None
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+
+def imported_names(modname, fromlist, m):
+    """Return the names of the modules an import of modname with fromlist, which returned m, depends on."""
+
+    name = getattr(m, '__name__', None)
+    if name is None:
+        return ()
+    if not fromlist:  # m is the top-level package, the module named is further down
+        return (name + modname[len(modname.partition('.')[0]):], )
+
+    names = [name]
+    for attr in fromlist:
+        sub = m.__dict__.get(attr)  # not getattr(), which would load a lazy module
+        if isinstance(sub, ModuleType):
+            names.append(sub.__name__)
+    return names
+
+
+class DependencyGraph(object):
+    """The modules each module imports, and the mtime of the source of each when loaded.
+
+       Edges are added by the import hook for the imports made by the code
+       of modules as they load, which leave names bound to what they import.
+       Imports within functions are made again on each call, so are left out.
+       An edge stays once seen, even if a reload stops the import being made,
+       which costs at most a reload more.
+    """
+
+    def __init__(self):
+        self.imports = {}    # module name -> set of names of the modules it imports
+        self.mtimes = {}     # module name -> mtime of its source when loaded, or None if not reloadable
+        for name, m in sys.modules.items():
+            if m is not None:
+                self.mtimes[name] = source_mtime(m)
+
+    def add(self, importer, names):
+        """Record that module importer imports the modules names."""
+
+        deps = self.imports.get(importer)
+        if deps is None:
+            deps = self.imports[importer] = set()
+            self._seen(importer)
+
+        for name in names:
+            if name not in deps and name != importer:
+                deps.add(name)
+                self._seen(name)
+
+    def _seen(self, name):
+        if name not in self.mtimes:
+            m = sys.modules.get(name)
+            if m is not None:
+                self.mtimes[name] = source_mtime(m)
+
+    def loaded(self, name):
+        """Note that module name has just been (re)loaded from its current source."""
+
+        self.mtimes[name] = source_mtime(sys.modules[name])
+
+    def changed(self):
+        """Return the names of the modules whose sources changed since they were loaded, sorted."""
+
+        modules = sys.modules
+        return sorted(name for name, mtime in self.mtimes.items()
+                      if mtime is not None and name in modules and modules[name] is not None and
+                      source_mtime(modules[name]) not in (None, mtime))
+
+    def dependents(self, names):
+        """Return the set of names, and those of the modules importing them, directly or not."""
+
+        importers = {}
+        for importer, deps in self.imports.items():
+            for name in deps:
+                importers.setdefault(name, []).append(importer)
+
+        found = set(names)
+        pending = list(names)
+        while pending:
+            for importer in importers.get(pending.pop(), ()):
+                if importer not in found:
+                    found.add(importer)
+                    pending.append(importer)
+        return found
+
+    def order(self, names):
+        """Return those of names that can be reloaded, each after the modules it imports.
+
+           Modules importing each other in a cycle are put in the order
+           they are first reached, going through the names sorted.
+        """
+        names = set(name for name in names
+                    if name != '__main__' and self.mtimes.get(name) is not None and sys.modules.get(name) is not None)
+        order = []
+        visited = set()
+
+        for name in sorted(names):
+            stack = [(name, iter(sorted(self.imports.get(name, ()))))]
+            visited.add(name)
+            while stack:
+                node, deps = stack[-1]
+                for dep in deps:
+                    if dep in names and dep not in visited:
+                        visited.add(dep)
+                        stack.append((dep, iter(sorted(self.imports.get(dep, ())))))
+                        break
+                else:
+                    stack.pop()
+                    order.append(node)
+        return order
+
+
+class ReloadReport(object):
+    """What reloading the modules whose sources changed did."""
+
+    def __init__(self, changed):
+        self.changed = changed  # modules whose sources changed
+        self.reloaded = []      # modules reloaded, in order: those changed and those importing them
+        self.failed = {}        # module name -> "ExceptionName: message"
+        self.skipped = []       # modules not reloaded, as they import one that failed
+        self.seconds = 0.0
+
+    def report(self, stream=None):
+        stream = stream or sys.stdout
+
+        print >>stream, "Reloaded %d modules in %.3fs, %d changed, %d failed, %d skipped" % (
+            len(self.reloaded), self.seconds, len(self.changed), len(self.failed), len(self.skipped))
+        for name in self.reloaded:
+            print >>stream, "  %s %s" % ("changed " if name in self.changed else "importer", name)
+        for name in sorted(self.failed):
+            print >>stream, "  failed   %s: %s" % (name, self.failed[name])
+        for name in self.skipped:
+            print >>stream, "  skipped  %s" % name
+
+
+def reload_changed(services, graph):
+    """Reload the modules of graph whose sources changed, and their importers, returning a ReloadReport.
+
+       Each module is reloaded into the module object already in use, after
+       the modules it imports, through the hooks of services, so that source
+       transforms and attribute overrides apply again, then its post-import
+       handlers are run again.  The importers of a module failing to reload
+       are skipped, and the module keeps what it had before.
+    """
+    clock = monotonic_clock()
+    start = clock()
+
+    report = ReloadReport(graph.changed())
+    failed = set()
+    modules = sys.modules
+
+    for name in graph.order(graph.dependents(report.changed)):
+        if graph.imports.get(name, set()) & failed:
+            report.skipped.append(name)
+            failed.add(name)
+            continue
+
+        m = modules[name]
+        try:
+            m = services._reload(m)
+        except Exception, exc:
+            modules[name] = m  # the import machinery removes a module failing to load
+            log.warning("Reload of module %r failed: %s: %s", name, type(exc).__name__, exc)
+            report.failed[name] = "%s: %s" % (type(exc).__name__, exc)
+            failed.add(name)
+            continue
+
+        graph.loaded(name)
+        services._rerun_watchers(name, m)
+        report.reloaded.append(name)
+
+    report.seconds = clock() - start
+    log.info("Reloaded %d modules in %.3fs", len(report.reloaded), report.seconds)
+    return report
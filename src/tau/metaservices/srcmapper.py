@@ -12,9 +12,10 @@ from os.path import splitext
 from optparse import OptionParser
 from collections import defaultdict
 
+from prunerules import add_prune_options, prune_rules_from_options
+import filesys_utils
 from filesys_utils import (
     walktrees,
-    pkgname_from_src_filename,
 )
 
 log = logging.getLogger('tplmapper')
@@ -49,6 +50,8 @@ class TemplatesOptionParser(OptionParser):
                         action="store", dest="run", default=None,
                         help="hook import machinery and run this program to see what gets imported.")
 
+        add_prune_options(self)
+
 
         #class DtmlTemplateUsageRecorder(ast.NodeVisitor):
         #
@@ -102,14 +105,15 @@ class TemplateReferenceAstRecorder(ast.NodeVisitor):
     funcname = None
     callname = None
 
-    def __init__(self, src_mapper):
+    def __init__(self, src_mapper, resolver=None):
         self.src_mapper = src_mapper
         self.attrpath = []
+        self.resolver = resolver or filesys_utils.DirectoryResolver()  # of package names, its own unless one is passed to share
 
     def visit(self, node, src_filename=None):
         if src_filename is not None:
             if self.src_filename != src_filename:
-                self.pkgname = pkgname_from_src_filename(src_filename)
+                self.pkgname = self.resolver.pkgname(src_filename)
                 print "====> pkgname set to %r" % (self.pkgname, )
                 self.src_filename = src_filename
 
@@ -440,7 +444,9 @@ def srcmapper():
 
     srcmapper = SourceMapper()
 
-    for filename in walktrees(rootdirs=topdir, filepatts=('*.py', '*.dtml'), recurse=True):
+    aliases = {}  # first path to each directory or file reached by others -> the other paths
+    for filename in walktrees(rootdirs=topdir, filepatts=('*.py', '*.dtml'), recurse=True, aliases=aliases,
+                              prune=prune_rules_from_options(options)):
         if options.verbose:
             log.info("FOUND: ", filename)
 
@@ -450,6 +456,10 @@ def srcmapper():
         if filename.endswith('.dtml'):
             srcmapper.add_dtml_file(filename)
 
+    if options.verbose:
+        for path in sorted(aliases):
+            log.info("SAME AS %s: %s", path, ' '.join(aliases[path]))
+
     print "Identified %d .dtml files" % len(srcmapper.dtml_files)
     for tpl_basename in srcmapper.dtml_files.keys():
         print tpl_basename
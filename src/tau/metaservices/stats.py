@@ -0,0 +1,158 @@
+"""Counters of the work done by the MetaServices import hook, cheap enough to leave on.
+"""
+
+import sys
+import json
+import atexit
+import thread
+
+from profiler import monotonic_clock
+
+
+class ImportStats(object):
+    """Per-module import counts, post-import handler calls, and hook versus import time.
+
+       Every import statement seen counts as a hit of the module named.  The
+       time within __import__ is split into that spent by the hook itself,
+       e.g. matching names, running post-import handlers and the fast path,
+       and that spent by the import machinery finding and loading modules.
+       Imports nested in the loading of another module are charged to the
+       outer import only once.
+
+       The hits and misses of the caches given, such as the DirectoryCache
+       and NegativeImportCache of the services, are reported too, as counted
+       by each cache since it was created.
+
+       Counters are plain dict entries updated without a lock, so a count may
+       now and then be lost to a race between threads.
+    """
+
+    def __init__(self, caches=None):
+        self.clock = monotonic_clock()
+        self.hits = {}            # module name -> number of imports of it seen
+        self.fastpath = 0         # number of those answered from sys.modules alone
+        self.watcher_calls = {}   # post-import handler -> number of calls made to it
+        self.hook_seconds = 0.0   # time spent in the hook, outside of the import machinery
+        self.wall_seconds = 0.0   # time spent in outermost imports, hook and machinery together
+        self.stacks = {}          # thread id -> [[start, seconds in the import machinery], ...]
+        self.caches = caches or {}  # name -> cache counting its hits and misses
+        self.processes = 1        # this one, and any others whose counts were merged in
+        self.merged = {'watcher_calls': {}, 'caches': {}}  # counts by name merged from other processes
+
+    def enter(self, modname):
+        self.hits[modname] = self.hits.get(modname, 0) + 1
+
+        tid = thread.get_ident()
+        stack = self.stacks.get(tid)
+        if stack is None:
+            stack = self.stacks[tid] = []
+        stack.append([self.clock(), 0.0])
+
+    def exit(self):
+        end = self.clock()
+        stack = self.stacks[thread.get_ident()]
+        start, in_machinery = stack.pop()
+
+        self.hook_seconds += end - start - in_machinery
+        if not stack:
+            self.wall_seconds += end - start
+
+    def machinery(self, func, *args):
+        """Return func(*args), charging the time it takes to the import machinery."""
+
+        frame = self.stacks[thread.get_ident()][-1]
+        start = self.clock()
+        try:
+            return func(*args)
+        finally:
+            frame[1] += self.clock() - start
+
+    def watcher_called(self, watcher):
+        self.watcher_calls[watcher] = self.watcher_calls.get(watcher, 0) + 1
+
+    @property
+    def import_seconds(self):
+        return self.wall_seconds - self.hook_seconds
+
+    def merge(self, stats):
+        """Add in the counts of stats, as returned by as_dict() of another process."""
+
+        for name, count in stats['hits'].items():
+            self.hits[name] = self.hits.get(name, 0) + count
+        self.fastpath += stats['fastpath']
+        self.hook_seconds += stats['hook_seconds']
+        self.wall_seconds += stats['hook_seconds'] + stats['import_seconds']
+        self.processes += stats['processes']
+
+        _add_counts(self.merged['watcher_calls'], stats['watcher_calls'])
+        for name, counts in stats['caches'].items():
+            _add_counts(self.merged['caches'].setdefault(name, {}), counts)
+
+    def as_dict(self):
+        watchers = {}
+        for watcher, count in self.watcher_calls.items():
+            key = _watcher_name(watcher)
+            watchers[key] = watchers.get(key, 0) + count
+        _add_counts(watchers, self.merged['watcher_calls'])
+
+        caches = dict((name, {'hits': cache.hits, 'misses': cache.misses}) for name, cache in self.caches.items())
+        for name, counts in self.merged['caches'].items():
+            _add_counts(caches.setdefault(name, {}), counts)
+
+        return {
+            'processes': self.processes,
+            'imports': sum(self.hits.values()),
+            'fastpath': self.fastpath,
+            'hook_seconds': self.hook_seconds,
+            'import_seconds': self.import_seconds,
+            'hits': dict(self.hits),
+            'watcher_calls': watchers,
+            'caches': caches,
+        }
+
+    def report(self, stream=None, limit=20):
+        """Print the totals, and the limit modules imported most often."""
+
+        stream = stream or sys.stdout
+        stats = self.as_dict()
+
+        print >>stream, "%d imports, %d by the fast path; %.3fms in the hook, %.3fms importing, in %d processes" % (
+            stats['imports'], stats['fastpath'], stats['hook_seconds'] * 1e3, stats['import_seconds'] * 1e3,
+            stats['processes'])
+
+        print >>stream, "%8s  %s" % ("hits", "module")
+        for name, count in sorted(stats['hits'].items(), key=lambda (name, count): (-count, name))[:limit]:
+            print >>stream, "%8d  %s" % (count, name)
+
+        for name, counts in sorted(stats['caches'].items()):
+            print >>stream, "%s: %d hits, %d misses" % (name, counts['hits'], counts['misses'])
+
+        if stats['watcher_calls']:
+            print >>stream, "%8s  %s" % ("calls", "post-import handler")
+            for name, count in sorted(stats['watcher_calls'].items()):
+                print >>stream, "%8d  %s" % (count, name)
+
+    def write_json(self, stream):
+        json.dump(self.as_dict(), stream, indent=1, sort_keys=True)
+
+    def dump_at_exit(self, filename=None):
+        """Have the report printed at exit, to stderr or, as JSON, to filename."""
+
+        def dump():
+            if filename is None:
+                self.report(sys.stderr)
+            else:
+                with open(filename, 'w') as f:
+                    self.write_json(f)
+
+        atexit.register(dump)
+
+
+def _add_counts(counts, more):
+    for name, count in more.items():
+        counts[name] = counts.get(name, 0) + count
+
+
+def _watcher_name(watcher):
+    callfunc = watcher.callfunc
+    return "%s: %s" % (watcher.pattern, getattr(callfunc, '__name__', None) or repr(callfunc))
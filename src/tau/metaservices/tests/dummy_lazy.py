@@ -0,0 +1,6 @@
+from dummy_replacements import executed
+
+executed.append(__name__)
+
+def answer():
+    return 42
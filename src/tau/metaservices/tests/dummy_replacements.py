@@ -1,3 +1,4 @@
 class ReplacementRequest(object):
     pass
 
+executed = []  # names of dummy modules whose code has been run
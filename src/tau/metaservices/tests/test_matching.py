@@ -0,0 +1,36 @@
+from tau.metaservices.matching import ModuleNameTable
+
+
+def test_exact_and_wildcard_segments():
+    table = ModuleNameTable()
+    table.add('myapp.views', 'exact')
+    table.add('myapp.views.*', 'children')
+    table.add('myapp.views.**', 'subtree')
+    table.add('myapp.*.admin', 'admin')
+    table.add('myapp.view?', 'glob')
+
+    assert table.lookup('myapp.views') == ('exact', 'subtree', 'glob')
+    assert table.lookup('myapp.views.admin') == ('children', 'subtree', 'admin')
+    assert table.lookup('myapp.views.admin.forms') == ('subtree', )
+    assert table.lookup('myapp.models') == ()
+    assert table.lookup('otherapp.views') == ()
+
+def test_values_keep_order_of_registration():
+    table = ModuleNameTable()
+    table.add('**', 1)
+    table.add('a.b', 2)
+    table.add('a.**', 3)
+    table.add('a.b', 4)
+
+    assert table.lookup('a.b') == (1, 2, 3, 4)
+    assert table.last('a.b') == 4
+    assert table.last('c', 'none') == 1
+
+    table.set('a.b', 5)
+    assert table.lookup('a.b') == (1, 3, 5)
+
+    table.discard('a.**', 3)
+    table.discard('**')
+    assert table.lookup('a.b') == (5, )
+    assert table.patterns() == [('a.b', 5)]
+    assert 'a.b' in table and 'a' not in table
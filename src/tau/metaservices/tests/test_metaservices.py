@@ -1,12 +1,33 @@
 import sys
 import logging
+import __builtin__
 
 from tau.metaservices import MetaServices
 
-def test_postimport():
+native_import = __builtin__.__import__
+native_meta_path = sys.meta_path[:]
+
+
+def isolated(testfunc):
+    """Run a test with the native __import__ restored and dummy modules forgotten afterwards."""
+
+    def run_isolated():
+        try:
+            testfunc()
+        finally:
+            __builtin__.__import__ = native_import
+            sys.meta_path[:] = native_meta_path
+            for modname in sys.modules.keys():
+                if modname.rpartition('.')[2].startswith('dummy_'):
+                    del sys.modules[modname]
+
+    run_isolated.__name__ = testfunc.__name__
+    return run_isolated
+
+def check_postimport(backend):
     from dummy_replacements import ReplacementRequest
 
-    ms = MetaServices()
+    ms = MetaServices(backend)
 
     def adjust(mod): # function to modify the target module before it is used
         mod.Request = ReplacementRequest
@@ -18,12 +39,12 @@ def test_postimport():
 
     assert isinstance(hs.handle_request(), ReplacementRequest)
 
-def test_preimport():
+def check_preimport(backend):
     from types import ModuleType
     from dummy_replacements import ReplacementRequest
 
 
-    ms = MetaServices()
+    ms = MetaServices(backend)
 
     class ModuleWatcher(ModuleType):
 
@@ -45,3 +66,1059 @@ def test_preimport():
     hs = HTTPServer()
 
     assert isinstance(hs.handle_request(), ReplacementRequest)
+
+@isolated
+def test_postimport():
+    check_postimport('ihooks')
+
+@isolated
+def test_postimport_metapath():
+    check_postimport('metapath')
+
+@isolated
+def test_preimport():
+    check_preimport('ihooks')
+
+@isolated
+def test_preimport_metapath():
+    check_preimport('metapath')
+
+@isolated
+def test_metapath_leaves_other_imports_alone():
+    import tau.metaservices.tests as tests_pkg
+
+    ms = MetaServices('metapath')
+    ms.call_after_import_of('dummy_webapp', lambda mod: None)
+
+    assert sys.meta_path[0] is ms.finder
+    assert __builtin__.__import__ is native_import
+    assert ms.finder.find_module('tau.metaservices.tests.dummy_request', tests_pkg.__path__) is None
+    assert ms.finder.find_module('tau.metaservices.tests.dummy_webapp', tests_pkg.__path__) is not None
+
+@isolated
+def test_fastpath_matches_builtin():
+    ms = MetaServices()
+    ms.call_after_import_of('dummy_never_imported', lambda mod: None)
+
+    class UnusedImporter(object):
+        def import_module(self, *args):
+            raise AssertionError("fast path fell through for %r" % (args[0], ))
+
+    ms.importer = UnusedImporter()
+
+    pkg_globals = dict(__name__='tau.metaservices.tests.test_metaservices', __package__=None)
+    cases = [
+        ('os.path', {}, None, -1),
+        ('os.path', {}, ['join'], -1),
+        ('os', pkg_globals, None, -1),                 # implicit relative, known to be absolute
+        ('test_metaservices', pkg_globals, None, -1),  # implicit relative, found in package
+        ('', pkg_globals, ['test_metaservices'], 1),
+        ('metaservices', pkg_globals, ['MetaServices'], 2),
+        ('tau.metaservices', {}, ['*'], 0),
+    ]
+    for modname, globals, fromlist, level in cases:
+        expected = native_import(modname, dict(globals), {}, fromlist, level)
+        assert ms.__import__(modname, dict(globals), {}, fromlist, level) is expected
+
+@isolated
+def test_fastpath_still_calls_watchers():
+    calls = []
+
+    ms = MetaServices()
+    ms.call_after_import_of('dummy_request', calls.append)
+
+    import dummy_request
+    import dummy_request
+
+    assert calls == [dummy_request, dummy_request]
+
+@isolated
+def test_bulk_subclassing_shares_one_importer():
+    from types import ModuleType
+
+    class TaggedModule(ModuleType):
+        pass
+
+    ms = MetaServices()
+    ms.subclass_modules({'dummy_request': TaggedModule, 'dummy_replacements': TaggedModule})
+
+    assert __builtin__.__import__ == ms.__import__
+    assert ms.subclass_importers.keys() == [TaggedModule]
+    importer = ms.subclass_importers[TaggedModule]
+
+    import dummy_request
+    import dummy_replacements
+
+    assert isinstance(dummy_request, TaggedModule)
+    assert isinstance(dummy_replacements, TaggedModule)
+    assert ms.subclass_importers == {TaggedModule: importer}
+
+def check_lazy_import(backend):
+    from dummy_replacements import executed
+
+    ms = MetaServices(backend)
+    ms.lazy_import('**.dummy_lazy')
+
+    import dummy_lazy
+    assert executed == []
+    assert ms.unloaded_lazy_modules() == ['tau.metaservices.tests.dummy_lazy']
+
+    assert dummy_lazy.answer() == 42
+    assert executed == ['tau.metaservices.tests.dummy_lazy']
+    assert ms.unloaded_lazy_modules() == []
+
+@isolated
+def test_lazy_import():
+    check_lazy_import('ihooks')
+
+@isolated
+def test_lazy_import_metapath():
+    check_lazy_import('metapath')
+
+@isolated
+def test_lazy_import_failure_and_force_load():
+    from tau.metaservices import LazyImportError
+
+    ms = MetaServices()
+    ms.lazy_import('**.dummy_lazy*')
+
+    import dummy_lazy_broken
+    try:
+        dummy_lazy_broken.anything
+    except LazyImportError, exc:
+        assert 'dummy_lazy_broken' in str(exc) and 'broken on purpose' in str(exc)
+    else:
+        assert False, "deferred load did not fail"
+
+    import dummy_lazy
+    assert ms.load_lazy_modules('**.dummy_lazy') == ['tau.metaservices.tests.dummy_lazy']
+    assert ms.unloaded_lazy_modules() == ['tau.metaservices.tests.dummy_lazy_broken']
+
+@isolated
+def test_watcher_patterns_and_order():
+    calls = []
+
+    ms = MetaServices()
+    ms.call_after_import_of('**.dummy_*', lambda mod: calls.append(('any', mod.__name__)))
+    ms.call_after_import_of('dummy_request', lambda mod: calls.append(('first', mod.__name__)))
+    ms.call_after_import_of('dummy_request', lambda mod: calls.append(('second', mod.__name__)))
+
+    import dummy_request
+
+    name = dummy_request.__name__
+    assert calls == [('any', name), ('first', name), ('second', name)]
+    del calls[:]
+
+    import dummy_webapp  # which imports dummy_request in turn
+
+    assert calls == [('any', name), ('first', name), ('second', name), ('any', dummy_webapp.__name__)]
+
+@isolated
+def test_watcher_file_patterns_and_once_per_importer():
+    calls = []
+
+    ms = MetaServices()
+    ms.call_after_import_of('dummy_request', lambda mod: calls.append('elsewhere'), from_filepatt='*/elsewhere/*')
+    ms.call_after_import_of('dummy_request', lambda mod: calls.append('here'), from_filepatt='*/test_metaservices.py')
+    ms.call_after_import_of('dummy_request', lambda mod: calls.append('once'), once_per_importer=True)
+
+    for _ in range(3):
+        import dummy_request
+
+    assert calls == ['here', 'once', 'here', 'here']
+    assert sys._getframe().f_code.co_filename in ms.importer_files
+
+def check_profiling(backend):
+    from StringIO import StringIO
+
+    ms = MetaServices(backend)
+    profiler = ms.enable_profiling()
+
+    import dummy_webapp  # which imports dummy_request in turn
+
+    assert ms.disable_profiling() is profiler
+
+    webapp, request = dummy_webapp.__name__, dummy_webapp.__name__.replace('webapp', 'request')
+    paths = [path for path, wall, own in profiler.records]
+    assert (webapp, request) in paths and (webapp, ) in paths
+
+    node = profiler.tree().children[webapp]
+    assert node.wall >= node.children[request].wall + node.own * 0.99
+
+    out = StringIO()
+    profiler.write_collapsed(out)
+    assert "%s;%s " % (webapp, request) in out.getvalue()
+
+    for report in (profiler.report_tree, profiler.report_top, profiler.write_json):
+        out = StringIO()
+        report(stream=out)
+        assert request in out.getvalue()
+
+@isolated
+def test_profiling():
+    check_profiling('ihooks')
+
+@isolated
+def test_profiling_metapath():
+    check_profiling('metapath')
+
+@isolated
+def test_threaded_imports_load_each_module_once():
+    import os
+    import shutil
+    import tempfile
+    import threading
+
+    nmodules, nthreads = 30, 12
+
+    tmpdir = tempfile.mkdtemp()
+    with open(os.path.join(tmpdir, 'stress_log.py'), 'w') as f:
+        f.write("executed = []\n")
+    for i in range(nmodules):  # each imports the next, so they form one big circular import
+        with open(os.path.join(tmpdir, 'stress_mod%d.py' % i), 'w') as f:
+            f.write("import time, stress_log\n"
+                    "stress_log.executed.append(__name__)\n"
+                    "time.sleep(0.001)\n"
+                    "import stress_mod%d\n"
+                    "done = True\n" % ((i + 1) % nmodules))
+    sys.path.insert(0, tmpdir)
+
+    calls = []
+    failures = []
+
+    def importer(offset):
+        try:
+            for i in range(nmodules):
+                m = __import__('stress_mod%d' % ((i * 7 + offset) % nmodules))
+                if not getattr(m, 'done', False):
+                    failures.append("%s partially initialized" % (m.__name__, ))
+        except Exception, exc:
+            failures.append(exc)
+
+    try:
+        ms = MetaServices()
+        ms.call_after_import_of('stress_mod*', lambda mod: calls.append(mod.__name__),
+                                from_filepatt='*/test_metaservices.py', once_per_importer=True)
+
+        threads = [threading.Thread(target=importer, args=(offset, )) for offset in range(nthreads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(30)
+
+        assert not [t for t in threads if t.is_alive()], "threads deadlocked"
+        assert failures == []
+
+        expected = sorted('stress_mod%d' % i for i in range(nmodules))
+        assert sorted(sys.modules['stress_log'].executed) == expected
+        assert sorted(calls) == expected
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+        for modname in sys.modules.keys():
+            if modname.rpartition('.')[2].startswith('stress_'):
+                del sys.modules[modname]
+
+@isolated
+def test_install_uninstall_and_context_manager():
+    ms = MetaServices()
+    ms.install()
+    assert __builtin__.__import__ == ms.__import__
+    ms.uninstall()
+    assert __builtin__.__import__ is native_import
+
+    with MetaServices('metapath') as ms:
+        assert sys.meta_path[0] is ms.finder
+    assert sys.meta_path == native_meta_path
+
+@isolated
+def test_one_shot_watchers_uninstall_when_all_fired():
+    calls = []
+
+    ms = MetaServices()
+    ms.call_after_import_of('dummy_request', lambda mod: calls.append('request'), once=True)
+    ms.call_after_import_of('dummy_webapp', lambda mod: calls.append('webapp'), once=True)
+
+    import dummy_request
+    import dummy_request
+    assert calls == ['request'] and ms.installed
+
+    import dummy_webapp
+    assert calls == ['request', 'webapp']
+    assert not ms.installed and __builtin__.__import__ is native_import
+
+@isolated
+def test_uninstall_keeps_hooks_chained_on_top():
+    calls = []
+
+    ms = MetaServices()
+    ms.call_after_import_of('dummy_request', lambda mod: calls.append('watcher'))
+
+    below = __builtin__.__import__
+    def recorder(*args):  # another hook, installed over this one and handing imports on to it
+        calls.append('recorder')
+        return below(*args)
+    __builtin__.__import__ = recorder
+
+    ms.uninstall()
+    assert __builtin__.__import__ is recorder and ms.passthrough
+
+    import dummy_request
+    assert calls == ['recorder']
+
+    ms.install()
+    assert __builtin__.__import__ is recorder and not ms.passthrough
+
+    import dummy_request
+    assert calls == ['recorder', 'recorder', 'watcher']
+
+@isolated
+def test_uninstall_unwinds_hooks_left_passing_through():
+    native_import = __builtin__.__import__
+
+    a, b = MetaServices(), MetaServices()
+    a.install()
+    b.install()
+    a.uninstall()
+    assert __builtin__.__import__ == b.__import__ and a.passthrough
+
+    b.uninstall()
+    assert __builtin__.__import__ is native_import and not a.passthrough
+
+    a.install()
+    assert __builtin__.__import__ == a.__import__ and a.saved_import is native_import
+    a.uninstall()
+    assert __builtin__.__import__ is native_import
+
+@isolated
+def test_stats():
+    from StringIO import StringIO
+
+    ms = MetaServices()
+    stats = ms.enable_stats()
+    ms.call_after_import_of('dummy_request', lambda mod: None)
+
+    import dummy_webapp  # which imports dummy_request in turn
+    import dummy_webapp
+    import dummy_request
+
+    assert ms.disable_stats() is stats
+    assert stats.hits['dummy_webapp'] == 2 and stats.hits['dummy_request'] == 2
+    assert stats.fastpath == 1
+    assert stats.watcher_calls.values() == [2]
+    assert stats.hook_seconds > 0 and stats.import_seconds > 0
+    assert stats.stacks.values() == [[]]
+
+    out = StringIO()
+    stats.report(stream=out)
+    assert "dummy_request: <lambda>" in out.getvalue()
+
+def check_attribute_overrides(backend):
+    from types import ModuleType
+    from dummy_replacements import ReplacementRequest
+    from tau.metaservices.attributes import FallbackModule
+
+    ms = MetaServices(backend)
+
+    def fallback(name):
+        if name.startswith('Missing'):
+            return name.lower()
+        raise AttributeError(name)
+
+    ms.override_attributes('dummy_request', {'Request': ReplacementRequest})
+    ms.override_attributes('dummy_webapp', fallback=fallback)
+
+    from dummy_webapp import HTTPServer
+    import dummy_request, dummy_webapp
+
+    assert isinstance(HTTPServer().handle_request(), ReplacementRequest)
+    assert type(dummy_request) is ModuleType
+
+    assert isinstance(dummy_webapp, FallbackModule)
+    assert dummy_webapp.HTTPServer is HTTPServer
+    assert dummy_webapp.MissingName == 'missingname'
+    assert not hasattr(dummy_webapp, 'other') and not hasattr(dummy_webapp, '__path__')
+
+@isolated
+def test_attribute_overrides():
+    check_attribute_overrides('ihooks')
+
+@isolated
+def test_attribute_overrides_metapath():
+    check_attribute_overrides('metapath')
+
+@isolated
+def test_attribute_fallback_of_lazy_module():
+    ms = MetaServices()
+    ms.lazy_import('**.dummy_lazy')
+    ms.override_attributes('**.dummy_lazy', {'answer': lambda: 43}, fallback=lambda name: name)
+
+    import dummy_lazy
+    assert dummy_lazy.answer() == 43
+    assert dummy_lazy.anything == 'anything'
+
+@isolated
+def test_trace_attributes():
+    import os
+    import json
+    import atexit
+    import tempfile
+    from tau.metaservices.tracing import AttributeTracer
+
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        ms = MetaServices()
+        tracer = ms.trace_attributes('dummy_request', sample=1, filename=filename, interval=60)
+
+        import dummy_request
+        for _ in range(5):
+            dummy_request.Request
+
+        name = dummy_request.__name__
+        assert isinstance(dummy_request, tracer.module_class)
+        assert tracer.counts[name]['Request'] == 5
+
+        tracer.flush()
+        with open(filename) as f:
+            assert json.load(f)['counts'][name]['Request'] == 5
+    finally:
+        tracer.stop()
+        os.remove(filename)
+    assert not tracer.flusher and (tracer.flush, (), {}) not in atexit._exithandlers
+
+    sampled = AttributeTracer(sample=3)
+    sampled.counts = tracer.counts
+    assert sampled.estimates()[name]['Request'] == 15
+    try:
+        sampled.flush()
+    except ValueError:
+        pass
+    else:
+        assert False, "flush() with no filename should raise ValueError"
+
+def check_implicit_relative_names(backend):
+    import os
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(tmpdir, 'dummy_rel_pkg'))
+    sources = {
+        '__init__.py': "",
+        'dummy_rel_user.py': "import dummy_rel_sib\n",  # implicit relative, so dummy_rel_pkg.dummy_rel_sib
+        'dummy_rel_sib.py': "value = 1\n",
+        'dummy_rel_other.py': "value = 1\n",
+    }
+    for filename, source in sources.items():
+        with open(os.path.join(tmpdir, 'dummy_rel_pkg', filename), 'w') as f:
+            f.write(source)
+    sys.path.insert(0, tmpdir)
+
+    try:
+        calls = []
+        ms = MetaServices(backend)
+        ms.call_after_import_of('dummy_rel_sib', lambda mod: calls.append(mod.__name__))
+        ms.call_after_import_of('dummy_rel_other', lambda mod: calls.append(mod.__name__))
+        ms.override_attributes('dummy_rel_other', {'value': 2})
+
+        import dummy_rel_pkg.dummy_rel_other  # a same-named module of another package, by its full name
+        assert calls == [] and dummy_rel_pkg.dummy_rel_other.value == 1, calls
+
+        import dummy_rel_pkg.dummy_rel_user
+        assert calls == ['dummy_rel_pkg.dummy_rel_sib'], calls
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+@isolated
+def test_implicit_relative_names():
+    check_implicit_relative_names('ihooks')
+
+@isolated
+def test_implicit_relative_names_metapath():
+    check_implicit_relative_names('metapath')
+
+def check_manifest(backend):
+    import os
+    import tempfile
+    from StringIO import StringIO
+
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        ms = MetaServices(backend)
+        recorder = ms.record_manifest()
+
+        import dummy_webapp  # which imports dummy_request in turn
+
+        assert ms.stop_manifest(filename) is recorder
+        webapp = dummy_webapp.__name__
+        request = webapp.replace('webapp', 'request')
+        names = recorder.names()
+        assert names.index(request) < names.index(webapp)
+
+        with open(filename, 'w') as f:  # leave out dummy_request, and add a module that is not there
+            f.write("# edited\n%s\nno_such_module_for_preload\n" % (webapp, ))
+        for name in (webapp, request):
+            del sys.modules[name]
+
+        report = ms.preload_manifest(filename)
+        assert report.loaded == [webapp]
+        assert report.failed.keys() == ['no_such_module_for_preload']
+        assert report.extras == {webapp: [request]}
+
+        out = StringIO()
+        report.report(out)
+        assert 'no_such_module_for_preload' in out.getvalue()
+    finally:
+        os.remove(filename)
+
+@isolated
+def test_manifest():
+    check_manifest('ihooks')
+
+@isolated
+def test_manifest_metapath():
+    check_manifest('metapath')
+
+@isolated
+def test_prefetch_manifest():
+    import os
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(tmpdir, 'dummy_pf_pkg'))
+    sources = {
+        'dummy_pf_a.py': "import dummy_pf_b\nvalue = dummy_pf_b.value + 1\n",
+        'dummy_pf_b.py': "value = 1\r\n",
+        os.path.join('dummy_pf_pkg', '__init__.py'): "value = 3\n",
+    }
+    for relpath, source in sources.items():
+        with open(os.path.join(tmpdir, relpath), 'wb') as f:
+            f.write(source)
+    manifest = os.path.join(tmpdir, 'manifest')
+    with open(manifest, 'w') as f:
+        f.write("dummy_pf_b\ndummy_pf_a\ndummy_pf_pkg\ndummy_pf_missing\n")
+    sys.path.insert(0, tmpdir)
+
+    try:
+        ms = MetaServices()
+        prefetcher = ms.prefetch_manifest(manifest, threads=2)
+        for t in prefetcher.threads:
+            t.join()
+        assert prefetcher.files_read == 3 and len(prefetcher.buffers) == 3
+        for relpath in sources:  # changed on disk after being read, so the modules tell where they were loaded from
+            with open(os.path.join(tmpdir, relpath), 'wb') as f:
+                f.write("value = 0\n")
+
+        import dummy_pf_a, dummy_pf_pkg
+        assert dummy_pf_a.value == 2 and dummy_pf_pkg.value == 3
+        assert prefetcher.hits == 3  # one open of each file, to load it
+        assert prefetcher.buffers == {} and prefetcher.buffered == 0
+
+        prefetcher._prefetch('dummy_pf_b')  # a thread coming late to a module already loaded
+        assert prefetcher.files_read == 4 and prefetcher.buffers == {} and prefetcher.buffered == 0
+
+        assert ms.stop_prefetch() is prefetcher and ms.prefetcher is None
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+@isolated
+def test_directory_cache():
+    import os
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    sys.path.insert(0, tmpdir)
+    try:
+        with open(os.path.join(tmpdir, 'dummy_dc_first.py'), 'w') as f:
+            f.write("value = 1\n")
+
+        ms = MetaServices()
+        ms.install()
+
+        import dummy_dc_first
+        assert dummy_dc_first.value == 1 and tmpdir in ms.dircache.listings
+
+        mtime = os.stat(tmpdir).st_mtime
+        with open(os.path.join(tmpdir, 'dummy_dc_second.py'), 'w') as f:
+            f.write("value = 2\n")
+        os.utime(tmpdir, (mtime + 1, mtime + 1))  # changed, whatever the resolution of mtimes
+
+        import dummy_dc_second
+        assert dummy_dc_second.value == 2
+        assert ms.dircache.hits and ms.dircache.misses
+
+        assert MetaServices(dircache=False).dircache is None
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+@isolated
+def test_negative_import_cache():
+    import os
+    import shutil
+    import tempfile
+
+    def importable(modname):
+        try:
+            __import__(modname)
+        except ImportError:
+            return False
+        return True
+
+    tmpdir = tempfile.mkdtemp()
+    sys.path.insert(0, tmpdir)
+    try:
+        ms = MetaServices(dircache=False)
+        stats = ms.enable_stats()
+
+        assert not importable('dummy_nc_first')
+        hits = ms.negative_cache.hits
+        assert not importable('dummy_nc_first')
+        assert ms.negative_cache.hits > hits
+        assert stats.as_dict()['caches']['negative_cache']['hits'] == ms.negative_cache.hits
+
+        with open(os.path.join(tmpdir, 'dummy_nc_first.py'), 'w') as f:
+            f.write("value = 1\n")
+
+        assert not importable('dummy_nc_first')  # remembered as missing
+        ms.forget_failed_imports()
+        assert importable('dummy_nc_first')
+
+        assert not importable('dummy_nc_third')
+        with open(os.path.join(tmpdir, 'dummy_nc_third.py'), 'w') as f:
+            f.write("value = 1\n")
+        sys.path.append(tmpdir + '-elsewhere')  # any change of sys.path forgets them all
+        assert importable('dummy_nc_third')
+        sys.path.remove(tmpdir + '-elsewhere')
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+def check_transform_source(backend):
+    import os
+    import ast
+    import shutil
+    import tempfile
+
+    calls = []
+
+    def strip_asserts(tree):
+        calls.append(tree)
+        tree.body = [node for node in tree.body if not isinstance(node, ast.Assert)]
+
+    tmpdir = tempfile.mkdtemp()
+    cache_dir = os.path.join(tmpdir, 'cache')
+    with open(os.path.join(tmpdir, 'dummy_transformed.py'), 'w') as f:
+        f.write("assert False, 'debug only'\nvalue = 42\n")
+    sys.path.insert(0, tmpdir)
+    try:
+        for run in range(2):  # the second time as in a new process, from the cache
+            sys.modules.pop('dummy_transformed', None)
+            ms = MetaServices(backend)
+            ms.transform_source('dummy_transformed', strip_asserts, cache_dir=cache_dir)
+
+            import dummy_transformed
+            assert dummy_transformed.value == 42
+            assert dummy_transformed.__file__ == os.path.join(tmpdir, 'dummy_transformed.py')
+            assert (ms.transform_cache.hits, ms.transform_cache.misses) == ((0, 1), (1, 0))[run]
+            ms.uninstall()
+
+        assert len(calls) == 1
+        assert len(os.listdir(cache_dir)) == 1
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+@isolated
+def test_transform_source():
+    check_transform_source('ihooks')
+
+@isolated
+def test_transform_source_metapath():
+    check_transform_source('metapath')
+
+def check_block_imports(backend):
+    import os
+    import shutil
+    import tempfile
+    from tau.metaservices import BlockedImportError
+
+    tmpdir = tempfile.mkdtemp()
+    with open(os.path.join(tmpdir, 'dummy_requester.py'), 'w') as f:
+        f.write("import dummy_plotting\n")
+    sys.path.insert(0, tmpdir)
+    try:
+        ms = MetaServices(backend)
+        ms.block_imports(['dummy_plotting'])
+        ms.block_imports({'dummy_testhelpers.**': {'helper': lambda: 'stubbed'}})
+
+        try:
+            import dummy_requester
+        except BlockedImportError, exc:
+            assert 'dummy_requester' in str(exc)
+        else:
+            assert False, "blocked import went ahead"
+        name, chain = ms.blocked_imports[-1]
+        assert name == 'dummy_plotting' and chain[-1] == 'dummy_requester'
+
+        import dummy_testhelpers
+        assert dummy_testhelpers.helper() == 'stubbed'
+        assert sys.modules['dummy_testhelpers'] is dummy_testhelpers
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+@isolated
+def test_block_imports():
+    check_block_imports('ihooks')
+
+@isolated
+def test_block_imports_metapath():
+    check_block_imports('metapath')
+
+def check_reload_changed(backend):
+    import os
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    def write(name, source, ahead=0):
+        filename = os.path.join(tmpdir, name + '.py')
+        with open(filename, 'w') as f:
+            f.write(source)
+        mtime = os.stat(filename).st_mtime + ahead
+        os.utime(filename, (mtime, mtime))
+
+    os.mkdir(os.path.join(tmpdir, 'dummy_rl_pkg'))
+    write('dummy_base', "VALUE = 1\n")
+    write('dummy_user', "from dummy_base import VALUE\nimport dummy_rl_pkg\n")
+    write('dummy_other', "import os\n")
+    write(os.path.join('dummy_rl_pkg', '__init__'), "VALUE = 1\n")
+    sys.path.insert(0, tmpdir)
+    try:
+        ms = MetaServices(backend)
+        graph = ms.track_dependencies()
+        adjusted = []
+        ms.call_after_import_of('dummy_base', adjusted.append)
+
+        import dummy_user, dummy_other
+        assert 'dummy_base' in graph.imports['dummy_user']
+        assert ms.reload_changed().reloaded == []
+
+        write('dummy_base', "VALUE = 2\n", ahead=10)
+        report = ms.reload_changed()
+        assert report.changed == ['dummy_base'] and report.reloaded == ['dummy_base', 'dummy_user'], report.reloaded
+        assert dummy_user.VALUE == 2 and sys.modules['dummy_user'] is dummy_user
+        assert adjusted.count(sys.modules['dummy_base']) == (2 if backend == 'metapath' else 3)  # 'ihooks' runs them per import
+
+        base = sys.modules['dummy_base']
+        write('dummy_base', "VALUE = \n", ahead=20)
+        report = ms.reload_changed()
+        assert report.failed.keys() == ['dummy_base'] and report.skipped == ['dummy_user']
+        assert sys.modules['dummy_base'] is base and base.VALUE == 2
+
+        write(os.path.join('dummy_rl_pkg', '__init__'), "VALUE = 2\n", ahead=10)
+        write('dummy_base', "VALUE = 3\n", ahead=30)
+        report = ms.reload_changed()
+        assert report.changed == ['dummy_base', 'dummy_rl_pkg'], report.changed  # a package too, by its __init__.py
+        assert report.reloaded == ['dummy_base', 'dummy_rl_pkg', 'dummy_user'], report.reloaded
+        assert dummy_user.dummy_rl_pkg.VALUE == 2 and sys.modules['dummy_rl_pkg'] is dummy_user.dummy_rl_pkg
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+@isolated
+def test_reload_changed():
+    check_reload_changed('ihooks')
+
+@isolated
+def test_reload_changed_metapath():
+    check_reload_changed('metapath')
+
+def _note_import(mod):
+    pass
+
+class _NotedModule(type(sys)):
+    pass
+
+def _import_in_child(modname):
+    import os
+    __import__(modname)
+    return os.getpid()
+
+@isolated
+def test_registrations_round_trip():
+    import pickle
+    from dummy_replacements import ReplacementRequest
+
+    ms = MetaServices('metapath', dircache=False)
+    ms.subclass_module('dummy_request', _NotedModule)
+    ms.call_after_import_of('dummy_*', _note_import, once_per_importer=True)
+    ms.override_attributes('dummy_webapp', {'Request': ReplacementRequest})
+    ms.block_imports(['dummy_plotting'])
+
+    spec = pickle.loads(pickle.dumps(ms.registrations()))
+    copy = MetaServices.from_registrations(spec)
+
+    assert copy.backend == 'metapath' and copy.dircache is None
+    assert copy.import_subclasses.patterns() == ms.import_subclasses.patterns()
+    [(pattern, watcher)] = copy.import_watchers.patterns()
+    assert (pattern, watcher.callfunc, watcher.importers) == ('dummy_*', _note_import, {})
+    assert copy.attribute_overrides.patterns() == ms.attribute_overrides.patterns()
+    assert copy.blocklist.patterns() == [('dummy_plotting', None)]
+    assert copy.finder in sys.meta_path
+
+@isolated
+def test_pool_children_send_counts_back():
+    import multiprocessing
+
+    ms = MetaServices()
+    ms.call_after_import_of('**.dummy_*', _note_import)
+    stats = ms.enable_stats()
+
+    pool = multiprocessing.Pool(2, *ms.pool_initializer())
+    try:
+        package = __name__.rpartition('.')[0]
+        pids = pool.map(_import_in_child, [package + '.dummy_request', package + '.dummy_webapp'] * 4)
+    finally:
+        pool.close()
+        pool.join()
+
+    assert ms.collect_child_counts() == 2
+    assert stats.processes == 3 and len(set(pids)) <= 2
+    assert stats.hits[package + '.dummy_request'] >= 4
+    assert sum(stats.as_dict()['watcher_calls'].values()) >= 8
+
+def test_walktrees():
+    import os
+    import shutil
+    import tempfile
+    from tau.metaservices.filesys_utils import walktrees
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for dirpath in ('pkg/sub', 'pkg/.git', 'other'):
+            os.makedirs(os.path.join(tmpdir, dirpath))
+        for filename in ('top.py', 'pkg/__init__.py', 'pkg/sub/mod.py', 'pkg/sub/page.dtml',
+                         'pkg/sub/notes.txt', 'pkg/.git/hook.py', 'other/tool.py'):
+            open(os.path.join(tmpdir, filename), 'w').close()
+
+        expected = sorted(os.path.join(tmpdir, filename) for filename in
+                          ('top.py', 'pkg/__init__.py', 'pkg/sub/mod.py', 'pkg/sub/page.dtml', 'other/tool.py'))
+        roots = [tmpdir, os.path.join(tmpdir, 'pkg')]  # nested, so reaching the same files twice
+        for threads in (1, 4):
+            found = list(walktrees(roots, ('*.py', '*.dtml', 'mod.*'), recurse=True, threads=threads))
+            assert sorted(found) == expected, found
+            assert found == list(walktrees(roots, ('*.py', '*.dtml', 'mod.*'), recurse=True))  # in the same order
+
+        assert list(walktrees(tmpdir, '*.py')) == [os.path.join(tmpdir, 'top.py')]
+        assert list(walktrees(tmpdir, (), recurse=True)) == []
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_walktrees_follows_each_directory_and_file_once():
+    import os
+    import shutil
+    import tempfile
+    from tau.metaservices.filesys_utils import walktrees
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        egg = os.path.join(tmpdir, 'eggs', 'dist.egg', 'pkg')
+        omelette = os.path.join(tmpdir, 'parts', 'omelette')
+        os.makedirs(egg)
+        os.makedirs(omelette)
+        open(os.path.join(egg, 'mod.py'), 'w').close()
+        os.symlink(egg, os.path.join(omelette, 'pkg'))                      # an omelette of the egg
+        os.symlink(os.path.join(egg, 'mod.py'), os.path.join(tmpdir, 'mod.py'))
+        os.symlink(tmpdir, os.path.join(egg, 'loop'))                        # back to the top, without end
+
+        walks = []
+        for threads in (1, 4, 4, 4):
+            aliases = {}
+            found = list(walktrees(tmpdir, '*.py', recurse=True, threads=threads, aliases=aliases))
+            assert len(found) == 1, found
+            assert sum(len(paths) for paths in aliases.values()) == 3, aliases  # the loop, the omelette, the link
+            assert any(os.path.join(omelette, 'pkg') in (first, ) + tuple(paths) for first, paths in aliases.items())
+            walks.append((found, aliases))
+        assert walks.count(walks[0]) == len(walks), walks  # the same paths, whatever the threads
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_walktrees_raises_what_a_thread_raised():
+    import os
+    import shutil
+    import tempfile
+    import threading
+    from tau.metaservices import filesys_utils
+    from tau.metaservices.filesys_utils import walktrees
+
+    tmpdir = tempfile.mkdtemp()
+    list_directory = filesys_utils.list_directory
+    def failing_list_directory(dirpath, identities=None):
+        if dirpath.endswith('bad'):
+            raise UnicodeDecodeError('ascii', '\xff', 0, 1, 'ordinal not in range(128)')
+        return list_directory(dirpath, identities)
+
+    filesys_utils.list_directory = failing_list_directory
+    try:
+        for dirpath in ('a/bad', 'b'):
+            os.makedirs(os.path.join(tmpdir, dirpath))
+
+        raised = []
+        def walk():
+            try:
+                list(walktrees(tmpdir, '*.py', recurse=True, threads=3))
+            except UnicodeDecodeError:
+                raised.append(True)
+        walker = threading.Thread(target=walk)
+        walker.daemon = True
+        walker.start()
+        walker.join(10)
+        assert not walker.is_alive(), "walk hung on the failure of a thread"
+        assert raised
+    finally:
+        filesys_utils.list_directory = list_directory
+        shutil.rmtree(tmpdir)
+
+def test_prune_rules():
+    from tau.metaservices.prunerules import PruneRules
+
+    rules = PruneRules("""
+# build output, anywhere
+build/
+*.pyc
+!keep.pyc
+/parts
+docs/**/*.txt
+node_[mo]odules
+\\#notes
+""".splitlines())
+    assert rules.prunes_dir('build') and rules.prunes_dir('src/pkg/build')
+    assert not rules.prunes_file('build')                         # directories only
+    assert rules.prunes_file('a/b/mod.pyc') and not rules.prunes_file('a/keep.pyc')
+    assert rules.prunes_dir('parts') and not rules.prunes_dir('src/parts')  # anchored
+    assert rules.prunes_file('docs/index.txt') and rules.prunes_file('docs/api/x/y.txt')
+    assert not rules.prunes_file('src/docs/index.txt')
+    assert rules.prunes_dir('node_modules') and rules.prunes_file('#notes')
+    assert not PruneRules() and not PruneRules().prunes_dir('build')
+
+def test_walktrees_prunes():
+    import os
+    import shutil
+    import tempfile
+    from tau.metaservices import filesys_utils
+    from tau.metaservices.filesys_utils import walktrees
+
+    tmpdir = tempfile.mkdtemp()
+    listed = []
+    list_directory = filesys_utils.list_directory
+    def recording_list_directory(dirpath, identities=None):
+        listed.append(dirpath)
+        return list_directory(dirpath, identities)
+
+    filesys_utils.list_directory = recording_list_directory
+    try:
+        for dirpath in ('src/build/lib', 'parts/omelette', 'src/parts'):
+            os.makedirs(os.path.join(tmpdir, dirpath))
+        for filename in ('src/mod.py', 'src/build/lib/mod.py', 'parts/omelette/mod.py', 'src/parts/mod.py',
+                         'src/test_mod.py'):
+            open(os.path.join(tmpdir, filename), 'w').close()
+
+        for threads in (1, 4):
+            del listed[:]
+            found = walktrees(tmpdir, '*.py', recurse=True, threads=threads,
+                              prune=['build/', '/parts', 'test_*.py'])
+            assert sorted(found) == [os.path.join(tmpdir, 'src/mod.py'), os.path.join(tmpdir, 'src/parts/mod.py')]
+            assert not [dirpath for dirpath in listed if 'build' in dirpath or 'omelette' in dirpath], listed
+    finally:
+        filesys_utils.list_directory = list_directory
+        shutil.rmtree(tmpdir)
+
+def test_directory_resolver():
+    import os
+    import shutil
+    import tempfile
+    from tau.metaservices.filesys_utils import DirectoryResolver, pkgname_from_src_filename
+
+    tmpdir = os.path.realpath(tempfile.mkdtemp())
+    try:
+        egg = os.path.join(tmpdir, 'eggs', 'dist-1.0-py2.7.egg')
+        develop = os.path.join(tmpdir, 'src', 'tool')
+        for dirpath in (os.path.join(egg, 'pkg', 'sub'), os.path.join(develop, 'tool.egg-info'),
+                        os.path.join(develop, 'tool')):
+            os.makedirs(dirpath)
+        for filename in (os.path.join(egg, 'pkg', '__init__.py'), os.path.join(egg, 'pkg', 'sub', '__init__.py'),
+                         os.path.join(egg, 'pkg', 'sub', 'a.py'), os.path.join(egg, 'pkg', 'sub', 'b.py'),
+                         os.path.join(develop, 'tool', '__init__.py'), os.path.join(develop, 'tool', 'main.py')):
+            open(filename, 'w').close()
+        omelette = os.path.join(tmpdir, 'omelette')
+        os.mkdir(omelette)
+        os.symlink(os.path.join('..', 'eggs', 'dist-1.0-py2.7.egg', 'pkg'), os.path.join(omelette, 'pkg'))
+
+        resolver = DirectoryResolver()
+        assert resolver.pkgname(os.path.join(egg, 'pkg', 'sub', 'a.py')) == 'pkg.sub'
+        assert (resolver.hits, resolver.misses) == (0, 1)
+        assert resolver.pkgname(os.path.join(egg, 'pkg', 'sub', 'b.py')) == 'pkg.sub'
+        assert resolver.pkgname(os.path.join(egg, 'pkg', '__init__.py')) == 'pkg'  # filled in by the first climb
+        assert (resolver.hits, resolver.misses) == (2, 1)
+
+        assert resolver.distro(os.path.join(egg, 'pkg', 'sub', 'a.py')) == (os.path.dirname(egg), 'dist')
+        assert resolver.distro(os.path.join(egg, 'pkg', 'b.py')) == (os.path.dirname(egg), 'dist')
+        assert resolver.distro(os.path.join(omelette, 'pkg', 'sub', 'b.py')) == (os.path.dirname(egg), 'dist')
+        assert resolver.distro(os.path.join(develop, 'tool', 'main.py')) == (develop, 'tool')
+        assert (resolver.hits, resolver.misses) == (3, 4)
+
+        os.remove(os.path.join(egg, 'pkg', 'sub', '__init__.py'))  # no longer a package
+        assert resolver.pkgname(os.path.join(egg, 'pkg', 'sub', 'a.py')) == 'pkg.sub'  # as remembered
+        assert pkgname_from_src_filename(os.path.join(egg, 'pkg', 'sub', 'a.py')) == ''
+        resolver.clear()
+        assert resolver.pkgname(os.path.join(egg, 'pkg', 'sub', 'a.py')) == ''
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_distribution_index():
+    import os
+    import shutil
+    import tempfile
+    from tau.metaservices.distindex import DistributionIndex
+
+    tmpdir = os.path.realpath(tempfile.mkdtemp())
+    def write(relpath, content=''):
+        filename = os.path.join(tmpdir, relpath)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content)
+
+    try:
+        site = os.path.join(tmpdir, 'site-packages')
+        write('site-packages/wheely-1.0.dist-info/RECORD',
+              "wheely/__init__.py,sha256=x,0\nzope/__init__.py,,\nzope/wheely/__init__.py,,\n../../bin/wheely,,\n")
+        write('site-packages/flat-2.0-py2.7.egg-info/installed-files.txt',
+              "../flat.py\n../zope/__init__.py\n../zope/flat/__init__.py\n")
+        write('develop/src/devel.egg-info/SOURCES.txt', "setup.py\nsrc/devel/__init__.py\nsrc/devel/sub/mod.py\n")
+        write('develop/src/devel.egg-info/top_level.txt', "devel\n")
+        write('eggs/baked-3.0-py2.7.egg/EGG-INFO/top_level.txt', "baked\n")
+
+        index = DistributionIndex([site, os.path.join(tmpdir, 'develop', 'src'),
+                                   os.path.join(tmpdir, 'eggs', 'baked-3.0-py2.7.egg')])
+        assert index.lookup(os.path.join(site, 'wheely', '__init__.py')) == (site, 'wheely')
+        assert index.lookup(os.path.join(site, 'wheely', 'data', 'x.txt')) == (site, 'wheely')
+        assert index.lookup(os.path.join(site, 'zope', 'wheely', '__init__.py')) == (site, 'wheely')
+        assert index.lookup(os.path.join(site, 'zope', 'flat', '__init__.py')) == (site, 'flat')
+        assert index.lookup(os.path.join(site, 'flat.py')) == (site, 'flat')
+        assert index.lookup(os.path.join(site, 'zope', '__init__.py')) is None  # a namespace package, shared
+        assert index.lookup(os.path.join(site, 'other.py')) is None
+        develop = os.path.join(tmpdir, 'develop', 'src')
+        assert index.lookup(os.path.join(develop, 'devel', 'sub', 'mod.py')) == (develop, 'devel')
+        assert index.lookup(os.path.join(tmpdir, 'eggs', 'baked-3.0-py2.7.egg', 'baked', 'core.py')) == (
+            os.path.join(tmpdir, 'eggs'), 'baked')
+    finally:
+        shutil.rmtree(tmpdir)
@@ -12,9 +12,10 @@ from os.path import splitext
 from optparse import OptionParser
 from collections import defaultdict
 
+from prunerules import add_prune_options, prune_rules_from_options
+import filesys_utils
 from filesys_utils import (
     walktrees,
-    pkgname_from_src_filename,
 )
 
 logger = logging.getLogger('tplmapper')
@@ -49,6 +50,8 @@ class TemplatesOptionParser(OptionParser):
                         action="store", dest="run", default=None,
                         help="hook import machinery and run this program to see what gets imported.")
 
+        add_prune_options(self)
+
 
         #class DtmlTemplateUsageRecorder(ast.NodeVisitor):
         #
@@ -105,11 +108,11 @@ class DtmlTemplates(object):
     def __init__(self):
         self.tpls = {}
 
-    def load(self, topdirs):
+    def load(self, topdirs, prune=None):
         """Load information about all DTML templates found under a directory tree.
         """
 
-        for filename in walktrees(topdirs, suffixes=('.dtml', ), recurse=True):
+        for filename in walktrees(topdirs, filepatts=('*.dtml', ), recurse=True, prune=prune):
             t = self.DtmlTemplate(filename)
             self.tpls[t.basename] = t
 
@@ -191,14 +194,15 @@ class TemplateReferenceAstRecorder(ast.NodeVisitor):
     funcname = None
     callname = None
 
-    def __init__(self, dtml_templates):
+    def __init__(self, dtml_templates, resolver=None):
         self.dtml_templates = dtml_templates
         self.attrpath = []
+        self.resolver = resolver or filesys_utils.DirectoryResolver()  # of package names, its own unless one is passed to share
 
     def visit(self, node, src_filename=None):
         if src_filename is not None:
             if self.src_filename != src_filename:
-                self.pkgname = pkgname_from_src_filename(src_filename)
+                self.pkgname = self.resolver.pkgname(src_filename)
                 print "====> pkgname set to %r" % (self.pkgname, )
                 self.src_filename = src_filename
 
@@ -369,14 +373,16 @@ def tplmapper():
     # 1) walk filesystem and locate every .dtml file
     # 2) parse ast of each .py file to detect invocations of each .dtml file
 
-    dtml_templates = DtmlTemplates()  # a place to collect information about DTML templates
-    dtml_templates.load(topdir)       # locate and make note of every DTML file found
+    prune = prune_rules_from_options(options)
+
+    dtml_templates = DtmlTemplates()     # a place to collect information about DTML templates
+    dtml_templates.load(topdir, prune)   # locate and make note of every DTML file found
 
     # dpage = self.views.SOME_TEMPLATE_NAME
 
     walker = TemplateReferenceAstRecorder(dtml_templates)
 
-    for pyfilename in walktrees(rootdirs=topdir, filepatts=('*.py', ), recurse=True):
+    for pyfilename in walktrees(rootdirs=topdir, filepatts=('*.py', ), recurse=True, prune=prune):
         if options.verbose:
             logger.info("EVALUATING: ", pyfilename)
 
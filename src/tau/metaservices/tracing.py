@@ -0,0 +1,111 @@
+"""Sampled counting of the attributes read from modules, to find out which are used.
+"""
+
+import os
+import json
+import atexit
+import random
+import threading
+
+from types import ModuleType
+
+from profiler import monotonic_clock
+
+
+class AttributeTracer(object):
+    """Counts a sample of the attribute reads from modules of its module_class.
+
+       Every read costs a call of a small __getattribute__, which takes one
+       in about every sample reads, picked at random so that reads repeating
+       in a fixed pattern are still sampled fairly, and counts it.  The time
+       spent counting is kept in recording_seconds, so the overhead can be
+       checked where the tracer runs.
+
+       The counts are written as JSON to filename, if given, at exit and,
+       with interval, every interval seconds in between.  The filename may
+       contain %(pid)s, for processes sharing a configuration to write files
+       of their own.  stop() ends the writing.
+    """
+
+    def __init__(self, sample=100, filename=None, interval=None):
+        if sample < 1:
+            raise ValueError("AttributeTracer sample must be at least 1, not %r" % (sample, ))
+
+        self.sample = sample
+        self.filename = filename
+        self.interval = interval
+        self.counts = {}               # module name -> {attribute name: sampled reads}
+        self.recording_seconds = 0.0   # time spent counting the sampled reads
+        self.module_class = self._make_module_class()
+        self.stopped = threading.Event()
+        self.flusher = None
+
+        if filename is not None:
+            atexit.register(self.flush)
+            if interval:
+                self.flusher = threading.Thread(target=self._flush_every, name="AttributeTracer flusher")
+                self.flusher.daemon = True
+                self.flusher.start()
+
+    def _make_module_class(self):
+        tracer = self
+        sample = self.sample
+        rng = random.Random()
+        clock = monotonic_clock()
+        getattribute = ModuleType.__getattribute__
+        countdown = [1]
+
+        class TracingModule(ModuleType):
+            """Module counting a sample of the reads of its attributes."""
+
+            def __getattribute__(self, name):
+                countdown[0] -= 1
+                if countdown[0] <= 0:
+                    start = clock()
+                    countdown[0] = int(rng.random() * (2 * sample - 1)) + 1  # sample reads apart, on average
+                    counts = tracer.counts.get(getattribute(self, '__name__'))
+                    if counts is None:
+                        counts = tracer.counts.setdefault(getattribute(self, '__name__'), {})
+                    counts[name] = counts.get(name, 0) + 1
+                    tracer.recording_seconds += clock() - start
+                return getattribute(self, name)
+
+        return TracingModule
+
+    def estimates(self):
+        """Return {module name: {attribute name: estimated reads}}, scaling up the sampled counts."""
+
+        return dict((modname, dict((name, count * self.sample) for name, count in counts.items()))
+                    for modname, counts in self.counts.items())
+
+    def flush(self, filename=None):
+        """Write the counts so far to filename, or that of the tracer, replacing the file atomically."""
+
+        filename = filename or self.filename
+        if filename is None:
+            raise ValueError("AttributeTracer has no filename to write its counts to")
+        filename = filename % {'pid': os.getpid()}
+        counts = dict((modname, dict(counts)) for modname, counts in self.counts.items())
+
+        tmpname = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmpname, 'w') as f:
+            json.dump({'sample': self.sample,
+                       'recording_seconds': self.recording_seconds,
+                       'counts': counts}, f, indent=1, sort_keys=True)
+        os.rename(tmpname, filename)
+
+    def _flush_every(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        """Stop writing the counts, at exit and every interval; the counting goes on, for flush() to write."""
+
+        self.stopped.set()
+        try:
+            atexit._exithandlers.remove((self.flush, (), {}))  # there is no atexit.unregister() in Python 2
+        except ValueError:
+            pass
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
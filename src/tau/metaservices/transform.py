@@ -0,0 +1,91 @@
+"""Compiling module sources through AST transforms, with the results cached on disk.
+"""
+
+import os
+import imp
+import ast
+import errno
+import marshal
+import hashlib
+import logging
+import tempfile
+
+log = logging.getLogger('tau.metaservices')
+
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'tau.metaservices', 'transformed')
+
+
+def transform_version(func):
+    """Return a version for transform func, changing whenever its code does."""
+
+    code = getattr(func, 'func_code', None)
+    if code is None:
+        return repr(func)
+    return hashlib.sha1(marshal.dumps(code)).hexdigest()
+
+
+class TransformCache(object):
+    """Code objects of transformed module sources, kept in files under cache_dir.
+
+       A file is named by a hash of the source, its filename, the versions of
+       the transforms applied and the bytecode magic number, so that a change
+       to any of these makes a new entry.  Entries are written to a temporary
+       file and renamed into place, so processes starting at once may both
+       write an entry, but never read one half written.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.hits = 0
+        self.misses = 0
+
+    def code(self, filename, source, transforms):
+        """Return the code of source, read from filename, as altered by transforms, (func, version) pairs.
+
+           Each func is given the ast.Module of the source, and returns the
+           tree to compile, or None if it altered the one given in place.
+        """
+        magic = imp.get_magic()
+        key = hashlib.sha1('\0'.join([magic, filename, source] + [version for func, version in transforms]))
+        path = os.path.join(self.cache_dir, key.hexdigest())
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if data.startswith(magic):
+                code = marshal.loads(data[len(magic):])
+                self.hits += 1
+                return code
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+
+        self.misses += 1
+        tree = compile(source, filename, 'exec', ast.PyCF_ONLY_AST, True)
+        for func, version in transforms:
+            tree = func(tree) or tree
+        code = compile(ast.fix_missing_locations(tree), filename, 'exec', 0, True)
+
+        self._write(path, magic + marshal.dumps(code))
+        return code
+
+    def _write(self, path, data):
+        try:
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError, exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+            fd, tmpname = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.rename(tmpname, path)
+            except:
+                os.remove(tmpname)
+                raise
+        except (IOError, OSError), exc:  # a cache that cannot be written only costs time
+            log.warning("Cannot cache transformed code in %r: %s", path, exc)